@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import cv2
+import numpy as np
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+from benchmarks.synthetic_frames import load_car_sprite, make_frame, car_on_line_frame
+from functions.preprocessing.preprocessing import pipeline, template_matching, get_hist, to_gray
+from functions.preprocessing.template_bank import load_template_bank
+from functions.imageProcessing.imageProcessing import process_image, mark_line_intersections, \
+    find_euclidian_distance, HIST_THRESHOLD, MIN_LANE_WIDTH
+from config import DATA, TEMPLATE_FOLDER, TEMPLATE_BANK_CACHE
+
+RESOLUTIONS = ((1280, 720), (1920, 1080), (2560, 1440))
+SCENARIOS = {"centered": make_frame, "car_on_line": car_on_line_frame}
+
+
+def time_stage(fn, repeats):
+    times = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, {
+        "repeats": repeats,
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "mean_s": statistics.mean(times),
+    }
+
+
+def check_accuracy(frame, car_bbox, left_boundary, right_boundary, width_tolerance_px, center_tolerance_px):
+    # The lines are found on the gaussian smoothed histogram, so the measured edges sit a few pixels
+    # inside the painted ones
+    expected = frame.expected_width_px()
+    measured = None
+    if left_boundary is not None and right_boundary is not None:
+        measured = find_euclidian_distance(left_boundary, right_boundary)
+
+    center = ((car_bbox[0] + car_bbox[2]) // 2, (car_bbox[1] + car_bbox[3]) // 2) if car_bbox else None
+    center_error = find_euclidian_distance(center, frame.car_center()) if center else None
+
+    return {
+        "expected_width_px": int(expected),
+        "measured_width_px": None if measured is None else float(measured),
+        "width_error_px": None if measured is None else float(measured - expected),
+        "car_center_error_px": None if center_error is None else float(center_error),
+        "passed": bool(measured is not None and abs(measured - expected) <= width_tolerance_px
+                       and center_error is not None and center_error <= center_tolerance_px),
+    }
+
+
+def benchmark_frame(frame, template_bank, template_folder, args):
+    img = frame.img
+    match_options = {"template_bank": template_bank, "pyramid_levels": args.pyramid_levels,
+                     "pyramid_top_k": args.pyramid_top_k}
+    stages = {}
+
+    gray = to_gray(img, bgr=True)
+    (_, car_bbox, _), stages["template_matching"] = time_stage(
+        lambda: template_matching(img, template_folder, gray=gray, **match_options), args.repeats)
+
+    (binary_img, car_bbox, _), stages["pipeline"] = time_stage(
+        lambda: pipeline(img, template_folder, bgr=True, **match_options), args.repeats)
+
+    y_range = (max(0, car_bbox[1]), min(binary_img.shape[0], car_bbox[3]))
+    hist, stages["get_hist"] = time_stage(lambda: get_hist(binary_img, y_range), args.repeats * 10)
+
+    _, stages["mark_line_intersections"] = time_stage(
+        lambda: mark_line_intersections(binary_img, car_bbox, hist, HIST_THRESHOLD, y_range, MIN_LANE_WIDTH,
+                                        visualize=False), args.repeats * 10)
+
+    (_, left_boundary, right_boundary, _), stages["process_image"] = time_stage(
+        lambda: process_image(img, template_folder, visualize=False, bgr=True, **match_options), args.repeats)
+
+    if args.roi_only:
+        _, stages["process_image_roi_only"] = time_stage(
+            lambda: process_image(img, template_folder, roi_only=True, visualize=False, bgr=True, **match_options),
+            args.repeats)
+
+    accuracy = check_accuracy(frame, car_bbox, left_boundary, right_boundary, args.width_tolerance,
+                              args.center_tolerance)
+    return stages, accuracy
+
+
+def compare_with_baseline(results, baseline_path, max_slowdown):
+    # Stages whose median time grew by more than max_slowdown times compared to an earlier run
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(tuple(r["resolution"]), r["scenario"]): r["stages"] for r in baseline["results"]}
+
+    regressions = []
+    for result in results:
+        stages = previous.get((tuple(result["resolution"]), result["scenario"]), {})
+        for stage, timing in result["stages"].items():
+            if stage in stages and timing["median_s"] > stages[stage]["median_s"] * max_slowdown:
+                regressions.append({
+                    "resolution": result["resolution"],
+                    "scenario": result["scenario"],
+                    "stage": stage,
+                    "baseline_median_s": stages[stage]["median_s"],
+                    "median_s": timing["median_s"],
+                })
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Times the image processing stages on synthetic frames "
+                                                 "and checks the measured road width against their geometry.")
+    parser.add_argument("--resolutions", nargs="+", default=[f"{w}x{h}" for w, h in RESOLUTIONS],
+                        help="frame sizes as WIDTHxHEIGHT")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--pyramid-levels", type=int, default=3,
+                        help="0 times the exhaustive template search (about 10 s per 1080p frame)")
+    parser.add_argument("--pyramid-top-k", type=int, default=8)
+    parser.add_argument("--roi-only", action="store_true", help="also time process_image with roi_only")
+    parser.add_argument("--width-tolerance", type=float, default=20.0, help="allowed width error in pixels")
+    parser.add_argument("--center-tolerance", type=float, default=5.0, help="allowed car center error in pixels")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare the stage times against")
+    parser.add_argument("--max-slowdown", type=float, default=1.5)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cv2.setNumThreads(1)
+
+    template_folder = os.path.join(ROOT, TEMPLATE_FOLDER)
+    template_bank = load_template_bank(template_folder, os.path.join(ROOT, DATA, TEMPLATE_BANK_CACHE))
+    sprite = load_car_sprite(template_folder)
+
+    results = []
+    for resolution in args.resolutions:
+        width, height = (int(v) for v in resolution.lower().split("x"))
+        for scenario in args.scenarios:
+            frame = SCENARIOS[scenario](sprite, width, height)
+            stages, accuracy = benchmark_frame(frame, template_bank, template_folder, args)
+            results.append({"resolution": [width, height], "scenario": scenario, "stages": stages,
+                            "accuracy": accuracy})
+            print(f"{width}x{height} {scenario}: process_image {stages['process_image']['median_s'] * 1000:.1f} ms, "
+                  f"width error {accuracy['width_error_px']} px, passed {accuracy['passed']}", file=sys.stderr)
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+        },
+        "settings": {
+            "repeats": args.repeats,
+            "pyramid_levels": args.pyramid_levels,
+            "pyramid_top_k": args.pyramid_top_k,
+            "width_tolerance_px": args.width_tolerance,
+            "center_tolerance_px": args.center_tolerance,
+        },
+        "results": results,
+        "accuracy_passed": all(r["accuracy"]["passed"] for r in results),
+    }
+    if args.baseline:
+        report["regressions"] = compare_with_baseline(results, args.baseline, args.max_slowdown)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    # A non-zero exit code lets a CI job fail on a regression in speed or accuracy
+    failed = not report["accuracy_passed"] or bool(report.get("regressions"))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import os
+import cv2
+import numpy as np
+
+# BGR colors of the synthetic track. Asphalt and the white lines pass the threshold/HSV masks of
+# pipeline() as road (lines above the gray threshold, asphalt below), grass and gravel fall in the
+# green and yellow HSV ranges that pipeline() removes.
+ASPHALT = (72, 72, 72)
+LINE = (240, 240, 240)
+GRASS = (40, 140, 40)
+GRAVEL = (100, 190, 220)
+
+
+class SyntheticFrame:
+    def __init__(self, img, left_line, right_line, car_bbox):
+        self.img = img
+        # (first, last) x of the painted boundary lines
+        self.left_line = left_line
+        self.right_line = right_line
+        self.car_bbox = car_bbox
+
+    def expected_width_px(self):
+        # The measurement runs between the inner edges of the two lines
+        return self.right_line[0] - self.left_line[1] - 1
+
+    def car_center(self):
+        x1, y1, x2, y2 = self.car_bbox
+        return (x1 + x2) // 2, (y1 + y2) // 2
+
+
+def load_car_sprite(template_folder, index=0):
+    fnames = sorted(f for f in os.listdir(template_folder) if f.lower().endswith(".png"))
+    sprite = cv2.imread(os.path.join(template_folder, fnames[index]))
+    if sprite is None:
+        raise ValueError(f"Could not read the car template {fnames[index]}")
+    return sprite
+
+
+def make_frame(sprite, width=1920, height=1080, road=(0.26, 0.73), line_width=12, car_x=0.5, car_y=0.575,
+               noise=20, seed=0):
+    # Top-down frame with the road between road[0] * width and road[1] * width (outer edges of the lines),
+    # grass to the left, gravel to the right and the car sprite centered at (car_x * width, car_y * height).
+    # The sprite keeps its size at every resolution, like the car in the game at a fixed camera height.
+    rng = np.random.default_rng(seed)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = ASPHALT
+    img += rng.integers(0, noise, (height, width, 3), dtype=np.uint8)
+
+    left = int(road[0] * width)
+    right = int(road[1] * width)
+    verge = max(1, line_width * 3)
+    img[:, :max(0, left - verge)] = GRASS
+    img[:, right + verge:] = GRAVEL
+    img[:, left:left + line_width] = LINE
+    img[:, right - line_width:right] = LINE
+
+    sprite_h, sprite_w = sprite.shape[:2]
+    x1 = int(car_x * width) - sprite_w // 2
+    y1 = int(car_y * height) - sprite_h // 2
+    x1 = min(max(0, x1), width - sprite_w)
+    y1 = min(max(0, y1), height - sprite_h)
+    img[y1:y1 + sprite_h, x1:x1 + sprite_w] = sprite
+
+    return SyntheticFrame(img, (left, left + line_width - 1), (right - line_width, right - 1),
+                          (x1, y1, x1 + sprite_w, y1 + sprite_h))
+
+
+def car_on_line_frame(sprite, width=1920, height=1080, **kwargs):
+    # The car straddles the left boundary line, which sends the measurement down the car-on-line branch
+    road = kwargs.pop("road", (0.26, 0.73))
+    return make_frame(sprite, width, height, road=road, car_x=road[0] + 0.005, **kwargs)
@@ -5,3 +5,14 @@ IMAGES = "images"
 CSV = "csv"
 TRUTH_DATA = "truthData"
 PROCESSED_LOG = "processedTimestampsLog"
+TEMPLATE_BANK_CACHE = "templateBankCache"
+# Measurement results of earlier runs, keyed by frame content and parameters
+RESULT_CACHE = "resultCache"
+# Calibrated pixel to meter ratio of every track
+CALIBRATION = "calibration"
+# Road type of every truth sample, labelled once per track
+TRACK_SEGMENTS_CACHE = "trackSegmentsCache"
+# Localhost UDP port on which the capture publishes frame timestamps to the in-game app
+FRAME_CHANNEL_PORT = 50515
+# Written next to the in-game app as the fallback when the channel cannot be used
+TIMESTAMP_FILE = "last_image_timestamp.txt"
@@ -0,0 +1,219 @@
+import os
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+from functions.frameStore.frame_store import FrameStoreWriter
+
+FORMAT_PNG = "png"
+FORMAT_FAST = "fast"
+FORMAT_STORE = "store"
+CAPTURE_FORMATS = (FORMAT_PNG, FORMAT_FAST, FORMAT_STORE)
+
+
+class ScreenSource:
+    # Grabs the primary screen, pyautogui is only imported here so the loop also runs on a headless box
+    def __init__(self):
+        import pyautogui
+        self.pyautogui = pyautogui
+
+    def grab(self):
+        return cv2.cvtColor(np.asarray(self.pyautogui.screenshot()), cv2.COLOR_RGB2BGR)
+
+
+class SyntheticSource:
+    # Generates frames with a moving pattern, for running the capture loop without a screen
+    def __init__(self, width=1920, height=1080, grab_time=0.0):
+        self.width = width
+        self.height = height
+        # Simulated time a screenshot takes
+        self.grab_time = grab_time
+        self.count = 0
+        self.background = np.tile(np.linspace(0, 255, width, dtype=np.uint8)[None, :, None], (height, 1, 3))
+
+    def grab(self):
+        if self.grab_time > 0:
+            time.sleep(self.grab_time)
+        frame = np.roll(self.background, self.count * 8, axis=1)
+        y = self.count * 4 % max(1, self.height - 40)
+        frame[y:y + 40, :, 1] = 255
+        self.count += 1
+        return frame
+
+
+class FrameRingBuffer:
+    # Bounded buffer between the grabbing thread and the encoders. When the encoders fall behind
+    # the new frame is dropped, so grabbing never waits for the disk and every frame that was
+    # accepted (and announced to the in-game app) is saved.
+    def __init__(self, capacity=32):
+        self.capacity = max(1, capacity)
+        self.frames = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        # Returns False when the buffer is full and the frame was dropped
+        with self.condition:
+            if len(self.frames) >= self.capacity:
+                self.dropped += 1
+                return False
+            self.frames.append(item)
+            self.condition.notify()
+            return True
+
+    def get(self):
+        # Returns None once the buffer is closed and empty
+        with self.condition:
+            while not self.frames and not self.closed:
+                self.condition.wait()
+            return self.frames.popleft() if self.frames else None
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class FrameEncoder:
+    def __init__(self, output_dir, fmt=FORMAT_PNG, png_level=3):
+        if fmt not in CAPTURE_FORMATS:
+            raise ValueError(f"Unknown capture format: {fmt}, expected one of {CAPTURE_FORMATS}")
+        self.output_dir = output_dir
+        self.fmt = fmt
+        os.makedirs(output_dir, exist_ok=True)
+        # Frames of the whole session are appended to chunk files instead of one file per frame
+        self.store_writer = FrameStoreWriter(output_dir) if fmt == FORMAT_STORE else None
+        if fmt == FORMAT_FAST:
+            # Still a lossless png the batch processing reads directly, only with much cheaper compression
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION, 1, cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_RLE]
+        else:
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION, png_level]
+
+    def frame_path(self, timestamp):
+        return os.path.join(self.output_dir, f"frame_{timestamp}.png")
+
+    def write(self, timestamp, frame):
+        path = self.frame_path(timestamp)
+        if self.store_writer is not None:
+            self.store_writer.append(timestamp, frame)
+        elif not cv2.imwrite(path, frame, self.params):
+            raise IOError(f"Could not write {path}")
+        return path
+
+    def close(self):
+        if self.store_writer is not None:
+            self.store_writer.close()
+
+
+class CaptureStats:
+    def __init__(self, fps):
+        self.target_fps = fps
+        self.grabbed = 0
+        self.encoded = 0
+        self.encode_errors = 0
+        # Ticks of the schedule that passed while a grab was still running
+        self.missed_ticks = 0
+        # Grabbed frames dropped because the ring buffer was full
+        self.dropped_frames = 0
+        self.start = None
+        self.end = None
+        self.lock = threading.Lock()
+
+    def elapsed(self):
+        if self.start is None:
+            return 0.0
+        end = self.end if self.end is not None else time.monotonic()
+        return end - self.start
+
+    def report(self):
+        elapsed = self.elapsed()
+        achieved = self.grabbed / elapsed if elapsed > 0 else 0.0
+        print("=== Capture summary ===")
+        print(f"Duration: {elapsed:.1f} s")
+        print(f"Target FPS: {self.target_fps:.1f}, achieved FPS: {achieved:.2f}")
+        print(f"Frames grabbed: {self.grabbed}, saved: {self.encoded}, failed to save: {self.encode_errors}")
+        print(f"Missed schedule ticks: {self.missed_ticks}")
+        print(f"Dropped frames (encoders behind): {self.dropped_frames}\n")
+
+
+def _encode_frames(buffer, encoder, stats, on_saved=None):
+    while True:
+        item = buffer.get()
+        if item is None:
+            return
+        timestamp, frame = item
+        try:
+            path = encoder.write(timestamp, frame)
+            with stats.lock:
+                stats.encoded += 1
+            if on_saved is not None:
+                on_saved(path)
+        except Exception as e:
+            print(f"Could not save frame {timestamp}: {e}")
+            with stats.lock:
+                stats.encode_errors += 1
+
+
+def run_capture(source, output_dir, fps=10, fmt=FORMAT_PNG, png_level=3, encoders=2, buffer_size=32,
+                duration=None, max_frames=None, on_frame=None, on_saved=None, stop_event=None, verbose=False):
+    # Grabs a frame every 1 / fps seconds on a monotonic schedule. Deadlines are advanced by a fixed
+    # interval instead of sleeping after the work, so encode time and disk speed do not change the
+    # frame rate. Frames are saved by a pool of encoder threads. on_frame(timestamp) is called right
+    # after a grabbed frame is buffered, so a dropped frame is never announced, and on_saved(path)
+    # once the frame is on disk (e.g. to feed live processing).
+    # Runs until duration seconds, max_frames frames or stop_event, and always flushes the buffer
+    # and prints the summary, also when interrupted.
+    encoder = FrameEncoder(output_dir, fmt, png_level)
+    buffer = FrameRingBuffer(buffer_size)
+    stats = CaptureStats(fps)
+    threads = [threading.Thread(target=_encode_frames, args=(buffer, encoder, stats, on_saved), daemon=True)
+               for _ in range(max(1, encoders))]
+    for thread in threads:
+        thread.start()
+
+    interval = 1.0 / fps
+    # Deadlines are start + tick * interval, so rounding errors do not add up over a long session
+    tick = 0
+    stats.start = time.monotonic()
+    try:
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                break
+            if max_frames is not None and stats.grabbed >= max_frames:
+                break
+            if duration is not None and tick >= round(duration * fps):
+                break
+            deadline = stats.start + tick * interval
+            now = time.monotonic()
+            if now < deadline:
+                time.sleep(deadline - now)
+
+            try:
+                timestamp = round(time.time() * 1000)
+                frame = source.grab()
+                stats.grabbed += 1
+                if buffer.put((timestamp, frame)) and on_frame is not None:
+                    on_frame(timestamp)
+                if verbose:
+                    print("Grabbed:", encoder.frame_path(timestamp))
+            except Exception as e:
+                print("Error:", e)
+
+            tick += 1
+            missed = int((time.monotonic() - stats.start) // interval) - tick
+            if missed > 0:
+                # The grab overran whole ticks, skip them instead of bursting to catch up
+                stats.missed_ticks += missed
+                tick += missed
+    finally:
+        stats.end = time.monotonic()
+        buffer.close()
+        for thread in threads:
+            thread.join()
+        encoder.close()
+        stats.dropped_frames = buffer.dropped
+        stats.report()
+
+    return stats
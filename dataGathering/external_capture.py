@@ -3,9 +3,23 @@ import os
 import signal
 import sys
 import time
-import pyautogui
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from config import DATA, IMAGES
+from config import DATA, IMAGES, FRAME_CHANNEL_PORT, TIMESTAMP_FILE
+from dataGathering.capture_loop import ScreenSource, FORMAT_PNG, run_capture
+from dataGathering.frame_channel import FrameTimestampPublisher
+
+# === Capture settings ===
+CAPTURE_FPS = 10
+# "png" (compressed with PNG_LEVEL 0-9), "fast" (png with the cheapest compression)
+# or "store" (uncompressed frames in one memory-mappable frame store for the whole session)
+CAPTURE_FORMAT = FORMAT_PNG
+PNG_LEVEL = 3
+ENCODER_THREADS = 2
+# Frames waiting for an encoder, new frames are dropped while it is full
+BUFFER_SIZE = 32
+# Also write every timestamp to the file, only for an in-game app that cannot open the socket (it then logs
+# "socket unavailable" to AC's log). Rewriting the file costs time on the capture thread for every frame
+TIMESTAMP_FILE_FALLBACK = False
 
 # Create session name
 now = time.localtime()
@@ -22,8 +36,8 @@ with open(session_name_file, "w") as f:
 output_dir = os.path.join(DATA, IMAGES, f"images_{session_name}")
 os.makedirs(output_dir, exist_ok=True)
 
-# Path to the timestamp file used for coordination
-timestamp_file = "last_image_timestamp.txt"
+# Path to the timestamp file used for coordination when the socket cannot be used
+timestamp_file = TIMESTAMP_FILE
 
 # === Optional delay before starting ===
 print("Waiting 30 seconds before starting capture...")
@@ -45,21 +59,9 @@ signal.signal(signal.SIGINT, lambda sig, frame: sys.exit(0))  # Handle Ctrl+C
 signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))  # Handle terminal kill
 
 # === Screenshot loop ===
-print("Saving screenshots to:", output_dir)
-while True:
-    try:
-        ts = round(time.time() * 1000)
-        screenshot = pyautogui.screenshot()
-        with open(timestamp_file, "w") as f:
-            f.write(str(ts))
-        filename = f"frame_{ts}.png"
-        filepath = f"{output_dir}/{filename}"
-        screenshot.save(filepath)
-
-        print("Saved:", filepath, True)
-        time.sleep(0.1)
-
-    except Exception as e:
-        print("Error:", e)
-        time.sleep(0.1)
+# The timestamp of every frame is sent to the in-game app, which logs the car position with it
+publisher = FrameTimestampPublisher(FRAME_CHANNEL_PORT, timestamp_file if TIMESTAMP_FILE_FALLBACK else None)
 
+print("Saving screenshots to:", output_dir)
+run_capture(ScreenSource(), output_dir, fps=CAPTURE_FPS, fmt=CAPTURE_FORMAT, png_level=PNG_LEVEL,
+            encoders=ENCODER_THREADS, buffer_size=BUFFER_SIZE, on_frame=publisher.publish)
@@ -0,0 +1,92 @@
+import os
+import time
+# Also imported by the in-game app, which runs on AC's Python 3.3: no f-strings in this file.
+# AC's Python does not always ship the socket module, the file fallback is used then.
+try:
+    import socket
+except ImportError:
+    socket = None
+
+CHANNEL_HOST = "127.0.0.1"
+
+
+class FrameTimestampPublisher:
+    # Sends the timestamp of every grabbed frame as one localhost UDP datagram. Sending never
+    # blocks and does not fail when the game is not listening. With fallback_file the latest
+    # timestamp is also written to that file for an in-game app without a socket module.
+    def __init__(self, port, fallback_file=None):
+        self.address = (CHANNEL_HOST, port)
+        self.fallback_file = fallback_file
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def publish(self, timestamp):
+        try:
+            self.sock.sendto(str(timestamp).encode("ascii"), self.address)
+        except OSError:
+            pass
+        if self.fallback_file is not None:
+            with open(self.fallback_file, "w") as f:
+                f.write(str(timestamp))
+
+    def close(self):
+        self.sock.close()
+
+
+class FrameTimestampSubscriber:
+    # Drains the frame timestamps published since the last call without blocking. Every published
+    # frame is returned once, instead of only the latest one the file held at that moment.
+    # Timestamps older than max_age_ms (e.g. queued while the game was loading) are discarded,
+    # because the car position logged with them would no longer match the image.
+    def __init__(self, port, fallback_file, max_age_ms=250):
+        self.fallback_file = fallback_file
+        self.max_age_ms = max_age_ms
+        self.last_file_timestamp = None
+        self.sock = None
+        if socket is not None:
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.bind((CHANNEL_HOST, port))
+                sock.setblocking(False)
+                self.sock = sock
+            except OSError:
+                self.sock = None
+
+    def uses_socket(self):
+        return self.sock is not None
+
+    def drain(self):
+        if self.sock is None:
+            return self._poll_file()
+
+        timestamps = []
+        while True:
+            try:
+                data = self.sock.recv(64)
+            except OSError:
+                # Nothing left to read
+                break
+            try:
+                timestamps.append(int(data.decode("ascii")))
+            except ValueError:
+                continue
+
+        now_ms = time.time() * 1000
+        return [ts for ts in timestamps if now_ms - ts <= self.max_age_ms]
+
+    def _poll_file(self):
+        # The previous handshake: only the latest timestamp written by the capture is seen
+        if not os.path.exists(self.fallback_file):
+            return []
+        try:
+            with open(self.fallback_file, "r") as f:
+                timestamp = int(f.read().strip())
+        except (OSError, ValueError):
+            return []
+        if timestamp == self.last_file_timestamp:
+            return []
+        self.last_file_timestamp = timestamp
+        return [timestamp]
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
@@ -0,0 +1,34 @@
+import csv
+import time
+# Imported by the in-game app, which runs on AC's Python 3.3: no f-strings in this file.
+
+
+class BufferedCsvWriter:
+    # Collects rows in memory and writes them in batches, so the game loop does not write and
+    # flush a file on every update. Pending rows are written once batch_rows rows are waiting or
+    # flush_interval seconds have passed since the last write.
+    def __init__(self, path, header, batch_rows=120, flush_interval=1.0):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(header)
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.rows = []
+        self.last_write = time.time()
+
+    def add(self, row, now=None):
+        self.rows.append(row)
+        now = time.time() if now is None else now
+        if len(self.rows) >= self.batch_rows or now - self.last_write >= self.flush_interval:
+            self.write_pending(now)
+
+    def write_pending(self, now=None):
+        if self.rows:
+            self.writer.writerows(self.rows)
+            self.rows = []
+            self.file.flush()
+        self.last_write = time.time() if now is None else now
+
+    def close(self):
+        self.write_pending()
+        self.file.close()
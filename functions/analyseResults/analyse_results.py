@@ -1,186 +1,222 @@
-from sklearn.metrics import mean_absolute_percentage_error, r2_score
-from scipy.stats import pearsonr
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+from .calibration import DEFAULT_PIXEL_RATIO
+from .streaming_metrics import MetricAccumulator, merge_accumulators
+from .track_segments import STRAIGHT, LEFT_TURN, RIGHT_TURN
 
-# === Needs to be defined manually, look at the example below. First image excluded
-# STRAIGHTS = [(2, 22), (51, 90), (101, 160), (230, 240), (271, 300), (371, 457),
-#              (480, 532), (554, 597), (609, 622), (644, 692), (714, 787), (801, 835), (856, 896)]
-# RIGHT_TURNS = [(23, 47), (186, 193), (262, 270), (356, 370), (458, 478), (540, 553),
-#                (623, 643), (693, 713), (794, 800), (836, 855)]
-# LEFT_TURNS = [(206, 227), (242, 258), (328, 346), (533, 548), (598, 608), (788, 793)]
-
-# STRAIGHTS = [(2, 8), (16, 19)]
-# RIGHT_TURNS = [(9, 15)]
-# LEFT_TURNS = [] # <- in the occurrence of no left turns
+ROAD_TYPE_NAMES = {STRAIGHT: "Straight", RIGHT_TURN: "Right Turn", LEFT_TURN: "Left Turn"}
 
 meter_to_pixel_ratio = 0.01249999999999986
-ground_truth_ratio = 0.018871954437029596
 
+# Pixel ratio of the width hypotheses, None keeps the widths as measured with the applied ratio (the ratio
+# calibrated for the track when the session was measured, see calibration.load_applied_ratio). The other
+# hypotheses convert the measured widths from the applied ratio
+WIDTH_HYPOTHESES = {
+    "applied": None,
+    "other": meter_to_pixel_ratio,
+    # Trial with a random ratio variable (performs really good)
+    "trial": 0.0160,
+}
+MAX_MAPE = 0.45
 
-def expand_ranges(ranges):
-    indices = set()
-    for start, end in ranges:
-        indices.update(range(start - 1, end))
-    return indices
 
+def hypothesis_widths(widths, ratio, applied_ratio):
+    return widths if ratio is None else widths * ratio / applied_ratio
 
-def evaluate_predictions(input_csv_path, output_csv, pred_col='road_width', truth_col='truth_width'):
-    df = pd.read_csv(input_csv_path)
-    df_full = df.copy()
 
-    # Removes the first row as the first row equals to the truth data.
-    # If that's not the case comment the next line and uncomment the df_analysis = df.copy line
-    # df_analysis = df.iloc[1:].copy()
-    df_analysis = df.copy()
+def add_row_metrics(chunk, pred_col='road_width', truth_col='truth_width', max_mape=MAX_MAPE,
+                    applied_ratio=DEFAULT_PIXEL_RATIO):
+    # Adds the row-wise metric columns to the rows that pass the outlier filter and returns those rows
+    chunk["MAPE"] = np.nan
+    chunk["rel_dist_diff_from_width"] = np.nan
+    chunk["other_width"] = np.nan
+    chunk["MAPE_other"] = np.nan
+    chunk["rel_pos_mape"] = np.nan
 
     # Add per-row MAPE (absolute percentage error)
-    df_analysis["MAPE"] = (abs(df_analysis[pred_col] - df_analysis[truth_col]) / df_analysis[truth_col]).astype(float)
-
-    df_analysis = df_analysis[df_analysis["MAPE"] < 0.45]
-
-    y_pred = df_analysis[pred_col].astype(float).values
-    y_true = df_analysis[truth_col].astype(float).values
-
-    # Overall metrics with the ground truth ratio
-    mape = mean_absolute_percentage_error(y_true, y_pred)
-    r2 = r2_score(y_true, y_pred)
-    corr, _ = pearsonr(y_true, y_pred)
-
-    print("Ground truth ratio metrics\n")
-    print(f"MAPE width: {mape:.4f}")
-    print(f"R-squared width: {r2:.4f}")
-    print(f"Pearson’s correlation width: {corr:.4f}\n")
+    mape = (abs(chunk[pred_col] - chunk[truth_col]) / chunk[truth_col]).astype(float)
+    keep = mape < max_mape
+    rows = chunk.index[keep]
 
+    chunk.loc[rows, "MAPE"] = mape[keep]
     # Calculate relative distance difference from measured width
-    df_analysis["rel_dist_diff_from_width"] = df_analysis["road_width"] - \
-                                              (df_analysis["distance_right"] + df_analysis["distance_left"])
-
-
-    #Transfer to the other width with the calculated
-    df_analysis["other_width"] = df_analysis["road_width"] * meter_to_pixel_ratio / ground_truth_ratio
-    df_analysis["MAPE_other"] = (abs(df_analysis["other_width"] - df_analysis[truth_col]) / df_analysis[truth_col]).astype(float)
-
-    y_pred_other = df_analysis["other_width"].astype(float).values
-
-    mape_other = mean_absolute_percentage_error(y_true, y_pred_other)
-    r2_other = r2_score(y_true, y_pred_other)
-    corr_other, _ = pearsonr(y_true, y_pred_other)
-
-    print("Calculated ratio variable metrics\n")
-    print(f"MAPE calculated ratio var: {mape_other:.4f}")
-    print(f"R-squared calculated ratio var: {r2_other:.4f}")
-    print(f"Pearson’s correlation calculated ratio var: {corr_other:.4f}\n")
-
-
-    # Trial with a random ratio variable (performs really good)
-    df_analysis["trial"] = df_analysis["road_width"] * 0.0160 / 0.018871954437029596
-    df_analysis["MAPE_trial"] = (
-                abs(df_analysis["trial"] - df_analysis[truth_col]) / df_analysis[truth_col]).astype(float)
+    chunk.loc[rows, "rel_dist_diff_from_width"] = chunk.loc[rows, "road_width"] - \
+        (chunk.loc[rows, "distance_right"] + chunk.loc[rows, "distance_left"])
 
-    y_pred_trial = df_analysis["trial"].astype(float).values
-
-    mape_trial = mean_absolute_percentage_error(y_true, y_pred_trial)
-    r2_trial = r2_score(y_true, y_pred_trial)
-    corr_trial, _ = pearsonr(y_true, y_pred_trial)
-
-    print("Trial ratio variable metrics\n")
-    print(f"MAPE width trial ratio var: {mape_trial:.4f}")
-    print(f"R-squared width trial ratio var: {r2_trial:.4f}")
-    print(f"Pearson’s correlation width trial ratio var: {corr_trial:.4f}\n")
+    # Transfer to the other width with the calculated
+    chunk.loc[rows, "other_width"] = hypothesis_widths(chunk.loc[rows, "road_width"], meter_to_pixel_ratio,
+                                                       applied_ratio)
+    chunk.loc[rows, "MAPE_other"] = (abs(chunk.loc[rows, "other_width"] - chunk.loc[rows, truth_col]) /
+                                     chunk.loc[rows, truth_col]).astype(float)
 
     # Relative position MAPE
-    df_analysis["pred_rel_pos"] = df_analysis["distance_left"] + df_analysis["distance_right"]
-    df_analysis["true_rel_pos"] = df_analysis["truth_left_rel_width"] + df_analysis["truth_right_rel_width"]
-
-    df_analysis["rel_pos_mape"] = (
-            abs(df_analysis["pred_rel_pos"] - df_analysis["true_rel_pos"]) / df_analysis["true_rel_pos"]
-    ).astype(float)
+    pred_rel_pos = chunk.loc[rows, "distance_left"] + chunk.loc[rows, "distance_right"]
+    true_rel_pos = chunk.loc[rows, "truth_left_rel_width"] + chunk.loc[rows, "truth_right_rel_width"]
+    chunk.loc[rows, "rel_pos_mape"] = (abs(pred_rel_pos - true_rel_pos) / true_rel_pos).astype(float)
 
-    y_pred_rel = df_analysis["pred_rel_pos"].astype(float).values
-    y_true_rel = df_analysis["true_rel_pos"].astype(float).values
+    return chunk.loc[rows]
 
-    mape_rel = mean_absolute_percentage_error(y_true_rel, y_pred_rel)
-    r2_rel = r2_score(y_true_rel, y_pred_rel)
-    corr_rel, _ = pearsonr(y_true_rel, y_pred_rel)
 
-    print("Relative distance metrics\n")
-    print(f"MAPE relative distance: {mape_rel:.4f}")
-    print(f"R-squared relative distance: {r2_rel:.4f}")
-    print(f"Pearson’s correlation relative distance: {corr_rel:.4f}\n")
+def accumulate_predictions(rows, accumulators=None, pred_col='road_width', truth_col='truth_width',
+                           applied_ratio=DEFAULT_PIXEL_RATIO):
+    # Adds the filtered rows of one chunk to the running metric sums
+    accumulators = accumulators if accumulators is not None else {}
+    y_true = rows[truth_col].astype(float).values
+    for name, ratio in WIDTH_HYPOTHESES.items():
+        y_pred = hypothesis_widths(rows[pred_col], ratio, applied_ratio).astype(float).values
+        accumulators.setdefault(name, MetricAccumulator()).update(y_true, y_pred)
 
-    df_full.loc[df_analysis.index, "MAPE"] = df_analysis["MAPE"]
-    df_full.loc[df_analysis.index, "rel_dist_diff_from_width"] = df_analysis["rel_dist_diff_from_width"]
-    df_full.loc[df_analysis.index, "other_width"] = df_analysis["other_width"]
-    df_full.loc[df_analysis.index, "MAPE_other"] = df_analysis["MAPE_other"]
-    df_full.loc[df_analysis.index, "rel_pos_mape"] = df_analysis["rel_pos_mape"]
+    y_pred_rel = (rows["distance_left"] + rows["distance_right"]).astype(float).values
+    y_true_rel = (rows["truth_left_rel_width"] + rows["truth_right_rel_width"]).astype(float).values
+    accumulators.setdefault("rel_distance", MetricAccumulator()).update(y_true_rel, y_pred_rel)
+    return accumulators
 
-    # Save updated CSV with row-wise MAPE
-    df_full.to_csv(output_csv, index=False)
 
+def print_prediction_metrics(accumulators, applied_ratio=None):
+    # applied_ratio is only shown, pooled sessions can each have their own
+    width, other, trial, rel = (accumulators[name] for name in ("applied", "other", "trial", "rel_distance"))
 
-def evaluate_subset(df, indices, pred_col='road_width', truth_col='truth_width'):
-    subset = df.iloc[list(indices)].copy()
-    y_true = subset[truth_col].astype(float)
-    y_pred = subset[pred_col].astype(float)
+    if applied_ratio is None:
+        print("Applied ratio metrics\n")
+    else:
+        print(f"Applied ratio ({applied_ratio:.6f}) metrics\n")
+    print(f"MAPE width: {width.mape():.4f}")
+    print(f"R-squared width: {width.r2():.4f}")
+    print(f"Pearson’s correlation width: {width.pearson():.4f}\n")
 
-    mape = mean_absolute_percentage_error(y_true, y_pred)
-    r2 = r2_score(y_true, y_pred)
-    corr, _ = pearsonr(y_true, y_pred)
-    return mape, r2, corr
+    print("Calculated ratio variable metrics\n")
+    print(f"MAPE calculated ratio var: {other.mape():.4f}")
+    print(f"R-squared calculated ratio var: {other.r2():.4f}")
+    print(f"Pearson’s correlation calculated ratio var: {other.pearson():.4f}\n")
 
+    print("Trial ratio variable metrics\n")
+    print(f"MAPE width trial ratio var: {trial.mape():.4f}")
+    print(f"R-squared width trial ratio var: {trial.r2():.4f}")
+    print(f"Pearson’s correlation width trial ratio var: {trial.pearson():.4f}\n")
 
-def evaluate_by_road_type(csv_path):
-    df = pd.read_csv(csv_path)
+    print("Relative distance metrics\n")
+    print(f"MAPE relative distance: {rel.mape():.4f}")
+    print(f"R-squared relative distance: {rel.r2():.4f}")
+    print(f"Pearson’s correlation relative distance: {rel.pearson():.4f}\n")
+
+
+def evaluate_predictions(data, output_csv=None, pred_col='road_width', truth_col='truth_width',
+                         chunk_size=100000, verbose=True, applied_ratio=DEFAULT_PIXEL_RATIO):
+    # data is either the merged DataFrame, which gets the row-wise metric columns in place, or the path of a
+    # merged csv. A csv is read in chunks and every chunk is written to output_csv as soon as it is done.
+    # Only running sums are kept, so pooled sessions of any size fit in memory. Rows with a MAPE of 0.45 or
+    # more are left out of the metrics. applied_ratio is the pixel ratio the widths were measured with.
+    # Returns the accumulators, which can be merged with those of other sessions (merge_accumulators).
+
+    # The first row can equal the truth data. If so, leave it out of data (or skiprows=[1] in read_csv)
+    if isinstance(data, pd.DataFrame):
+        chunks = [data]
+    else:
+        chunks = pd.read_csv(data, chunksize=chunk_size)
+
+    accumulators = {}
+    for i, chunk in enumerate(chunks):
+        rows = add_row_metrics(chunk, pred_col, truth_col, applied_ratio=applied_ratio)
+        accumulate_predictions(rows, accumulators, pred_col, truth_col, applied_ratio)
+
+        # Save updated CSV with row-wise MAPE
+        if output_csv is not None:
+            chunk.to_csv(output_csv, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+
+    if verbose:
+        print_prediction_metrics(accumulators, applied_ratio)
+    return accumulators
+
+
+def _accumulate_csv(args):
+    input_path, applied_ratio, pred_col, truth_col, chunk_size = args
+    # Session files (results.parquet / results.pkl) are loaded whole, csv files are read in chunks
+    if input_path.endswith(".parquet"):
+        input_path = pd.read_parquet(input_path)
+    elif input_path.endswith(".pkl"):
+        input_path = pd.read_pickle(input_path)
+    return evaluate_predictions(input_path, None, pred_col, truth_col, chunk_size, verbose=False,
+                                applied_ratio=applied_ratio)
+
+
+def evaluate_pooled_predictions(input_paths, workers=1, pred_col='road_width', truth_col='truth_width',
+                                chunk_size=100000, applied_ratios=None):
+    # Metrics over the merged csvs of many sessions, each session accumulated on its own process.
+    # applied_ratios holds the pixel ratio every session was measured with, the default ratio when not given
+    if applied_ratios is None:
+        applied_ratios = [DEFAULT_PIXEL_RATIO] * len(input_paths)
+    jobs = [(path, ratio, pred_col, truth_col, chunk_size) for path, ratio in zip(input_paths, applied_ratios)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            sessions = list(executor.map(_accumulate_csv, jobs))
+    else:
+        sessions = [_accumulate_csv(job) for job in jobs]
+
+    accumulators = merge_accumulators(sessions)
+    print_prediction_metrics(accumulators)
+    return accumulators
+
+
+def accumulate_groups(df, group_col, accumulators=None, pred_col='road_width', truth_col='truth_width'):
+    # Adds the rows of one chunk to one accumulator per group
+    chunk = {group: MetricAccumulator().update(rows[truth_col].astype(float).values,
+                                               rows[pred_col].astype(float).values)
+             for group, rows in df.groupby(group_col)}
+    return merge_accumulators([accumulators or {}, chunk])
+
+
+def grouped_metrics(df, group_col, pred_col='road_width', truth_col='truth_width'):
+    # MAPE, R² and Pearson of every group, from the same accumulators as evaluate_predictions
+    accumulators = accumulate_groups(df, group_col, pred_col=pred_col, truth_col=truth_col)
+    groups = sorted(accumulators)
+    metrics = pd.DataFrame({
+        "frames": [accumulators[group].n for group in groups],
+        "mape": [accumulators[group].mape() for group in groups],
+        "r2": [accumulators[group].r2() for group in groups],
+        "pearson": [accumulators[group].pearson() for group in groups],
+    }, index=pd.Index(groups, name=group_col))
+    return metrics
+
+
+def road_type_metrics(df, pred_col='road_width', truth_col='truth_width'):
+    return grouped_metrics(df, "road_type", pred_col, truth_col)
+
+
+def read_results(data):
+    # The results DataFrame itself or the path of a results csv
+    return data if isinstance(data, pd.DataFrame) else pd.read_csv(data)
+
+
+def evaluate_by_road_type(data):
+    df = read_results(data)
 
+    # Skip first row as per convention
     df_analysis = df.iloc[1:].copy()
 
-    groups = {
-        "Straight": expand_ranges(STRAIGHTS),
-        "Right Turn": expand_ranges(RIGHT_TURNS),
-        "Left Turn": expand_ranges(LEFT_TURNS),
-    }
+    # Road types are labelled from the truth raceline, see track_segments.py
+    metrics = road_type_metrics(df_analysis)
 
-    for name, indices in groups.items():
-        valid_indices = [i for i in indices if 0 <= i < len(df_analysis)]
-        if not valid_indices:
-            print(f"\n=== {name} ===")
+    for road_type, name in ROAD_TYPE_NAMES.items():
+        print(f"\n=== {name} ===")
+        if road_type not in metrics.index or metrics.loc[road_type, "frames"] < 2:
             print("No data available for this group.\n")
             continue
 
-        mape, r2, corr = evaluate_subset(df_analysis, valid_indices)
-        print(f"\n=== {name} ===")
-        print(f"MAPE: {mape:.4f}")
-        print(f"R-squared: {r2:.4f}")
-        print(f"Pearson correlation: {corr:.4f}\n")
+        row = metrics.loc[road_type]
+        print(f"MAPE: {row['mape']:.4f}")
+        print(f"R-squared: {row['r2']:.4f}")
+        print(f"Pearson correlation: {row['pearson']:.4f}\n")
 
 
-def generate_grouped_results(input_csv_path, output_csv_path):
-    df = pd.read_csv(input_csv_path)
+def generate_grouped_results(data, output_csv_path):
+    df = read_results(data)
 
     # Skip first row as per convention
     df = df.iloc[1:].copy()
 
-    # Map of road type to expanded indices
-    groups = {
-        "straight": expand_ranges(STRAIGHTS),
-        "right": expand_ranges(RIGHT_TURNS),
-        "left": expand_ranges(LEFT_TURNS),
-    }
-
-    # Assign road type per index
-    road_types = ["unknown"] * len(df)
-    for road_type, indices in groups.items():
-        for idx in indices:
-            if idx < len(df):  # Ensure index is within bounds
-                road_types[idx] = road_type
-
-    df["road_type"] = road_types
-
-    # Filter to only known types
-    df_filtered = df[df["road_type"] != "unknown"]
-
     # Select and reorder columns
-    output_df = df_filtered[[
+    output_df = df[[
         "filename",
         "road_type",
         "truth_width",
@@ -0,0 +1,184 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Pixel to meter ratio measured for the Nurburgring GP track, used until a track has been calibrated
+DEFAULT_PIXEL_RATIO = 0.018871954437029596
+
+
+def ratio_metrics(pixel_widths, truth_widths, ratios, block_size=4096):
+    # MAPE, R² and Pearson of the widths ratio * pixel_widths for every candidate ratio at once.
+    # Same definitions as sklearn's mean_absolute_percentage_error / r2_score and scipy's pearsonr.
+    # The error sums are added up over blocks of block_size frames, so memory does not grow with the session
+    px = np.asarray(pixel_widths, dtype=float)
+    truth = np.asarray(truth_widths, dtype=float)
+    ratios = np.asarray(ratios, dtype=float)
+
+    eps = np.finfo(np.float64).eps
+    sum_ape = np.zeros(len(ratios))
+    ss_res = np.zeros(len(ratios))
+    for start in range(0, len(px), block_size):
+        block_truth = truth[start:start + block_size]
+        error = ratios[:, None] * px[None, start:start + block_size] - block_truth
+        sum_ape += np.sum(np.abs(error) / np.maximum(np.abs(block_truth), eps), axis=1)
+        ss_res += np.sum(error * error, axis=1)
+    mape = sum_ape / len(px) if len(px) else np.full(len(ratios), np.nan)
+
+    ss_tot = np.sum((truth - truth.mean()) ** 2)
+    r2 = 1 - ss_res / ss_tot if ss_tot > 0 else np.full(len(ratios), np.nan)
+
+    # Pearson is invariant to a positive scale, so one value holds for every candidate ratio
+    if len(px) > 1 and px.std() > 0 and truth.std() > 0:
+        pearson = np.corrcoef(px, truth)[0, 1]
+    else:
+        pearson = np.nan
+
+    return pd.DataFrame({"ratio": ratios, "mape": mape, "r2": r2, "pearson": pearson})
+
+
+def bootstrap_ratio_ci(pixel_widths, truth_widths, ratios, n_bootstrap=1000, confidence=0.95, seed=0,
+                       block_size=4096):
+    # Confidence interval of the MAPE-optimal ratio. Every resample is a row of multinomial counts and the
+    # MAPE of all resamples for all ratios is a (resamples x rows) @ (rows x ratios) product. The rows are
+    # processed in blocks of block_size: the counts of a block are drawn from the rows the resamples have
+    # left (a binomial split, then a multinomial within the block), which gives the same distribution as
+    # drawing them at once, so memory does not grow with the session length
+    px = np.asarray(pixel_widths, dtype=float)
+    truth = np.asarray(truth_widths, dtype=float)
+    ratios = np.asarray(ratios, dtype=float)
+    n = len(px)
+
+    rng = np.random.default_rng(seed)
+    boot_mape = np.zeros((n_bootstrap, len(ratios)))
+    remaining = np.full(n_bootstrap, n)
+    for start in range(0, n, block_size):
+        end = min(n, start + block_size)
+        # Draws of each resample that land in this block, out of those left for rows start and after
+        in_block = rng.binomial(remaining, (end - start) / (n - start))
+        remaining -= in_block
+        counts = rng.multinomial(in_block, np.full(end - start, 1.0 / (end - start)))
+
+        errors = np.abs(ratios[:, None] * px[None, start:end] - truth[start:end]) / np.abs(truth[start:end])
+        boot_mape += counts @ errors.T
+    boot_mape /= n
+
+    best = ratios[np.argmin(boot_mape, axis=1)]
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(best, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def candidate_ratios(pixel_widths, truth_widths, n_candidates=2001, spread=0.5):
+    # Evenly spaced candidates around the median truth / pixel ratio
+    center = float(np.median(np.asarray(truth_widths, dtype=float) / np.asarray(pixel_widths, dtype=float)))
+    return np.linspace(center * (1 - spread), center * (1 + spread), n_candidates)
+
+
+def calibrate_pixel_ratio(df, applied_ratio, pred_col='road_width', truth_col='truth_width', road_type_col='road_type',
+                          ratios=None, n_bootstrap=1000, max_mape=0.45):
+    # Sweeps the candidate ratios over the frames of a merged results table. The measured widths are
+    # converted back to pixels with the ratio the batch applied. As in evaluate_predictions, frames with
+    # a MAPE of max_mape or more at the applied ratio are left out. Per road type when the column exists.
+    widths = df[pred_col].astype(float)
+    truth = df[truth_col].astype(float)
+    keep = (np.abs(widths - truth) / truth < max_mape).to_numpy()
+    data = df[keep]
+
+    px = (data[pred_col].astype(float) / applied_ratio).to_numpy()
+    truth = data[truth_col].astype(float).to_numpy()
+    if len(px) < 2:
+        raise ValueError("Not enough frames to calibrate the pixel ratio")
+
+    if ratios is None:
+        ratios = candidate_ratios(px, truth)
+
+    sweep = ratio_metrics(px, truth, ratios)
+    sweep.insert(0, "road_type", "all")
+
+    tables = [sweep]
+    if road_type_col in data.columns:
+        for road_type, group in data.groupby(road_type_col):
+            group_px = px[data[road_type_col].to_numpy() == road_type]
+            group_truth = group[truth_col].astype(float).to_numpy()
+            table = ratio_metrics(group_px, group_truth, ratios)
+            table.insert(0, "road_type", road_type)
+            tables.append(table)
+
+    best = sweep.loc[sweep["mape"].idxmin()]
+    ci_low, ci_high = bootstrap_ratio_ci(px, truth, ratios, n_bootstrap)
+
+    result = {
+        "ratio": float(best["ratio"]),
+        "mape": float(best["mape"]),
+        "r2": float(best["r2"]),
+        "pearson": float(best["pearson"]),
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+        "frames": int(len(px)),
+    }
+    return result, pd.concat(tables, ignore_index=True)
+
+
+def print_calibration(result, sweep):
+    print("Pixel ratio calibration\n")
+    print(f"Best ratio: {result['ratio']:.6f} (95% CI {result['ci_low']:.6f} - {result['ci_high']:.6f}, "
+          f"{result['frames']} frames)")
+    print(f"MAPE: {result['mape']:.4f}")
+    print(f"R-squared: {result['r2']:.4f}")
+    print(f"Pearson’s correlation: {result['pearson']:.4f}\n")
+
+    for road_type, table in sweep[sweep["road_type"] != "all"].groupby("road_type"):
+        row = table.loc[table["mape"].idxmin()]
+        print(f"{road_type}: best ratio {row['ratio']:.6f}, MAPE {row['mape']:.4f}, R-squared {row['r2']:.4f}")
+
+
+def applied_ratio_path(csv_file):
+    # Lives next to the measured csv, e.g. measured_data_ratio.json
+    return os.path.splitext(csv_file)[0] + "_ratio.json"
+
+
+def session_pixel_ratio(csv_file, resume, pixel_ratio=None):
+    # The ratio a session's widths are measured with. A resumed session keeps the ratio its first rows
+    # were written with (sessions from before the ratio was recorded used the default), a new session
+    # records the ratio it is started with so that the calibration can convert its widths back to pixels
+    ratio_path = applied_ratio_path(csv_file)
+    if resume:
+        if os.path.exists(ratio_path):
+            with open(ratio_path, "r") as f:
+                return json.load(f)["ratio"]
+        return DEFAULT_PIXEL_RATIO
+
+    ratio = DEFAULT_PIXEL_RATIO if pixel_ratio is None else pixel_ratio
+    with open(ratio_path, "w") as f:
+        json.dump({"ratio": ratio}, f)
+    return ratio
+
+
+def load_applied_ratio(csv_file):
+    return session_pixel_ratio(csv_file, resume=True)
+
+
+def load_pixel_ratio(calibration_file, track, default=DEFAULT_PIXEL_RATIO):
+    if os.path.exists(calibration_file):
+        with open(calibration_file, "r") as f:
+            calibrations = json.load(f)
+        if track in calibrations:
+            return calibrations[track]["ratio"]
+    return default
+
+
+def save_pixel_ratio(calibration_file, track, result):
+    calibrations = {}
+    if os.path.exists(calibration_file):
+        with open(calibration_file, "r") as f:
+            calibrations = json.load(f)
+    calibrations[track] = result
+
+    # Write to a temporary file and swap it in, so an interrupted save never leaves a broken file
+    tmp_file = calibration_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(calibrations, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, calibration_file)
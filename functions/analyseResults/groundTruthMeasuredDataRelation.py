@@ -1,57 +1,161 @@
 import pandas as pd
 import numpy as np
+from scipy.spatial import cKDTree
 
 
-def map_measured_to_truth(truth_data_df, measured_data_df):
-    track_length = 5148 # length for the Nurburgring GP track
-    truth_data_df = truth_data_df.copy()
-
-    # Create normalized track position
-    truth_data_df['track_pos'] = np.linspace(0, 1, len(truth_data_df), endpoint=False)
-
-    results = []
-    for _, row in measured_data_df.iterrows():
-        car_lap_pos = row['lap_position']
-
-        # Closest index in truth track
-        i_closest = (truth_data_df['track_pos'] - car_lap_pos).abs().idxmin()
-        truth_row = truth_data_df.iloc[i_closest]
-
-        # Distance to raceline
-        car_x, car_y = row['pos_x'], row['pos_y']
-        raceline_x, raceline_y = truth_row['pos_x'], truth_row['pos_y']
-        dist_to_raceline = np.sqrt((car_x - raceline_x)**2 + (car_y - raceline_y)**2)
-
-        # Track width and lateral distances
-        truth_width = np.hypot(
-            truth_row['left_border_x'] - truth_row['right_border_x'],
-            truth_row['left_border_y'] - truth_row['right_border_y']
-        )
-        truth_left_rel_width = np.hypot(
-            truth_row['pos_x'] - truth_row['left_border_x'],
-            truth_row['pos_y'] - truth_row['left_border_y']
-        )
-        truth_right_rel_width = np.hypot(
-            truth_row['pos_x'] - truth_row['right_border_x'],
-            truth_row['pos_y'] - truth_row['right_border_y']
-        )
-
-        results.append({
-            'car_x': car_x,
-            'car_y': car_y,
-            'lap_position': car_lap_pos,
-            'closest_track_index': i_closest,
-            'calc_track_pos': truth_row['track_pos'],
-            'track_pos_diff (m)': abs(car_lap_pos - truth_row['track_pos']) * track_length,
-            'track_raceline_x': raceline_x,
-            'track_raceline_y': raceline_y,
-            'distance_to_raceline': dist_to_raceline,
-            'left_border': (float(truth_row['left_border_x']), float(truth_row['left_border_y'])),
-            'right_border': (float(truth_row['right_border_x']), float(truth_row['right_border_y'])),
-            'filename': row['filename'],
-            'truth_left_rel_width': truth_left_rel_width,
-            'truth_right_rel_width': truth_right_rel_width,
-            'truth_width': truth_width
-        })
-
-    return pd.DataFrame(results)
+def circular_track_distance(a, b):
+    # Distance between two normalized track positions, going either way around the lap
+    diff = np.abs(a - b) % 1.0
+    return np.minimum(diff, 1.0 - diff)
+
+
+class TruthIndex:
+    def __init__(self, truth_data_df):
+        self.left_border_x = truth_data_df['left_border_x'].to_numpy(dtype=float)
+        self.left_border_y = truth_data_df['left_border_y'].to_numpy(dtype=float)
+        self.right_border_x = truth_data_df['right_border_x'].to_numpy(dtype=float)
+        self.right_border_y = truth_data_df['right_border_y'].to_numpy(dtype=float)
+        self.raceline_x = truth_data_df['pos_x'].to_numpy(dtype=float)
+        self.raceline_y = truth_data_df['pos_y'].to_numpy(dtype=float)
+
+        # Create normalized track position
+        self.track_pos = np.linspace(0, 1, len(truth_data_df), endpoint=False)
+        self._tree = None
+
+    def __len__(self):
+        return len(self.track_pos)
+
+    @property
+    def tree(self):
+        # The raceline and both borders are indexed, so a car close to a border still finds its own
+        # part of the track. Point k of the tree belongs to truth sample k % len(self)
+        if self._tree is None:
+            points = np.column_stack([
+                np.concatenate([self.raceline_x, self.left_border_x, self.right_border_x]),
+                np.concatenate([self.raceline_y, self.left_border_y, self.right_border_y]),
+            ])
+            self._tree = cKDTree(points)
+        return self._tree
+
+
+def build_truth_index(truth_data_df):
+    # Built once per track and shared between every session mapped to it
+    return TruthIndex(truth_data_df)
+
+
+def neighbours_by_lap_position(truth_index, lap_pos):
+    truth_count = len(truth_index)
+    track_pos = truth_index.track_pos
+
+    # The two truth samples around each lap position, the last sample wraps around to the first one
+    i_next = np.searchsorted(track_pos, lap_pos, side='left')
+    i_prev = (i_next - 1) % truth_count
+    i_next = i_next % truth_count
+
+    # Closest index in truth track, ties go to the earlier sample
+    dist_prev = circular_track_distance(lap_pos, track_pos[i_prev])
+    dist_next = circular_track_distance(lap_pos, track_pos[i_next])
+    i_closest = np.where(dist_next < dist_prev, i_next, i_prev)
+
+    # Fraction of the sample spacing between the two neighbours
+    t = ((lap_pos - track_pos[i_prev]) % 1.0) * truth_count
+
+    return i_prev, i_next, t, i_closest
+
+
+def neighbours_by_world_position(truth_index, car_x, car_y):
+    truth_count = len(truth_index)
+    rx, ry = truth_index.raceline_x, truth_index.raceline_y
+
+    _, nearest = truth_index.tree.query(np.column_stack([car_x, car_y]))
+    nearest = nearest % truth_count
+
+    # Project the car onto the raceline segments before and after the nearest sample
+    best_dist = None
+    for seg_start in ((nearest - 1) % truth_count, nearest):
+        seg_end = (seg_start + 1) % truth_count
+        dx = rx[seg_end] - rx[seg_start]
+        dy = ry[seg_end] - ry[seg_start]
+        length_sq = dx * dx + dy * dy
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = ((car_x - rx[seg_start]) * dx + (car_y - ry[seg_start]) * dy) / length_sq
+        t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+        dist = np.hypot(car_x - (rx[seg_start] + t * dx), car_y - (ry[seg_start] + t * dy))
+
+        if best_dist is None:
+            best_dist, i_prev, i_next, best_t = dist, seg_start, seg_end, t
+        else:
+            closer = dist < best_dist
+            best_dist = np.where(closer, dist, best_dist)
+            i_prev = np.where(closer, seg_start, i_prev)
+            i_next = np.where(closer, seg_end, i_next)
+            best_t = np.where(closer, t, best_t)
+
+    i_closest = np.where(best_t > 0.5, i_next, i_prev)
+    return i_prev, i_next, best_t, i_closest
+
+
+def map_measured_to_truth(truth_data_df, measured_data_df, track_length=5148, interpolate=False,
+                          match_mode="lap_position", truth_index=None):
+    # track_length is the length for the Nurburgring GP track.
+    # match_mode "lap_position" picks the truth sample by the game's spline position, "spatial" by projecting
+    # the car's world position onto the nearest raceline segment
+    if truth_index is None:
+        truth_index = build_truth_index(truth_data_df)
+    track_pos = truth_index.track_pos
+
+    car_lap_pos = measured_data_df['lap_position'].to_numpy(dtype=float)
+    car_x = measured_data_df['pos_x'].to_numpy(dtype=float)
+    car_y = measured_data_df['pos_y'].to_numpy(dtype=float)
+    lap_pos = car_lap_pos % 1.0
+
+    if match_mode == "lap_position":
+        i_prev, i_next, t, i_closest = neighbours_by_lap_position(truth_index, lap_pos)
+    elif match_mode == "spatial":
+        i_prev, i_next, t, i_closest = neighbours_by_world_position(truth_index, car_x, car_y)
+    else:
+        raise ValueError(f"Unknown match_mode: {match_mode}")
+
+    if interpolate:
+        # Linear interpolation between the neighbouring samples
+        def sample(values):
+            return values[i_prev] + (values[i_next] - values[i_prev]) * t
+
+        calc_track_pos = (track_pos[i_prev] + t / len(truth_index)) % 1.0
+    else:
+        def sample(values):
+            return values[i_closest]
+
+        calc_track_pos = track_pos[i_closest]
+
+    left_x, left_y = sample(truth_index.left_border_x), sample(truth_index.left_border_y)
+    right_x, right_y = sample(truth_index.right_border_x), sample(truth_index.right_border_y)
+    race_x, race_y = sample(truth_index.raceline_x), sample(truth_index.raceline_y)
+
+    # Distance to raceline
+    dist_to_raceline = np.hypot(car_x - race_x, car_y - race_y)
+
+    # Track width and lateral distances
+    truth_width = np.hypot(left_x - right_x, left_y - right_y)
+    truth_left_rel_width = np.hypot(race_x - left_x, race_y - left_y)
+    truth_right_rel_width = np.hypot(race_x - right_x, race_y - right_y)
+
+    return pd.DataFrame({
+        'car_x': car_x,
+        'car_y': car_y,
+        'lap_position': car_lap_pos,
+        'closest_track_index': i_closest,
+        'calc_track_pos': calc_track_pos,
+        'track_pos_diff (m)': circular_track_distance(lap_pos, calc_track_pos) * track_length,
+        'track_raceline_x': race_x,
+        'track_raceline_y': race_y,
+        'distance_to_raceline': dist_to_raceline,
+        'left_border_x': left_x,
+        'left_border_y': left_y,
+        'right_border_x': right_x,
+        'right_border_y': right_y,
+        'filename': measured_data_df['filename'].to_numpy(),
+        'truth_left_rel_width': truth_left_rel_width,
+        'truth_right_rel_width': truth_right_rel_width,
+        'truth_width': truth_width,
+    })
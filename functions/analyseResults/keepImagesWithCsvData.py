@@ -1,5 +1,6 @@
 import os
 import pandas as pd
+from functions.frameStore.frame_store import list_frame_names
 from config import DATA, IMAGES
 
 
@@ -9,7 +10,8 @@ def compare_images_with_csv(csv_path, image_folder):
 
     image_folder_path = os.path.join(DATA, IMAGES, image_folder)
 
-    all_images = [f for f in os.listdir(image_folder_path) if f.endswith(".png")]
+    # Also lists the frames of a frame store
+    all_images = list_frame_names(image_folder_path)
 
     missing_in_folder = valid_filenames - set(all_images)
     extra_in_folder = set(all_images) - valid_filenames
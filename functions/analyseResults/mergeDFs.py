@@ -1,3 +1,9 @@
+import numpy as np
+import pandas as pd
+
+TELEMETRY_COLUMNS = ['lap_position', 'pos_x', 'pos_y']
+
+
 def merge_dfs(main_df, extra_df):
     # Perform inner join on 'filename' and keep extra columns at the end
     df_merged = main_df.merge(extra_df, how='inner', on='filename')
@@ -8,3 +14,61 @@ def merge_dfs(main_df, extra_df):
     df_merged = df_merged[original_columns + new_columns]
 
     return df_merged
+
+
+def frame_timestamps(filenames):
+    # Frames are named "frame_<milliseconds>.png" by the external capture
+    return pd.to_numeric(filenames.astype(str).str.extract(r'(\d+)\.\w+$')[0], errors='coerce')
+
+
+def merge_telemetry(telemetry_df, measured_df, method='interpolate', tolerance_ms=100):
+    # Joins every measured frame to the car state at the moment the frame was grabbed, taken from the
+    # full-rate telemetry log by timestamp instead of the row the game wrote when it received the
+    # frame. method "interpolate" interpolates linearly between the updates around the frame,
+    # "nearest" takes the closest update (pd.merge_asof). Frames without an update within
+    # tolerance_ms (e.g. while the game was paused) are dropped, like frames missing from the
+    # game csv in merge_dfs. The columns match merge_dfs(game_df, measured_df).
+    telemetry = telemetry_df.dropna(subset=['timestamp']).sort_values('timestamp')
+    telemetry = telemetry.drop_duplicates('timestamp', keep='last')
+    if telemetry.empty:
+        raise ValueError("The telemetry log has no samples")
+
+    frames = measured_df.copy()
+    frames['timestamp'] = frame_timestamps(frames['filename'])
+    frames = frames.dropna(subset=['timestamp'])
+    frames['timestamp'] = frames['timestamp'].astype('int64')
+
+    if method == 'nearest':
+        merged = pd.merge_asof(frames.sort_values('timestamp'),
+                               telemetry[['timestamp'] + TELEMETRY_COLUMNS].astype({'timestamp': 'int64'}),
+                               on='timestamp', direction='nearest', tolerance=tolerance_ms)
+        merged = merged.dropna(subset=TELEMETRY_COLUMNS)
+    elif method == 'interpolate':
+        t = telemetry['timestamp'].to_numpy(dtype=float)
+        ft = frames['timestamp'].to_numpy(dtype=float)
+
+        # The updates before and after each frame have to be close enough to interpolate between
+        i_next = np.searchsorted(t, ft, side='left')
+        i_prev = np.clip(i_next - 1, 0, len(t) - 1)
+        i_next = np.clip(i_next, 0, len(t) - 1)
+        inside = (ft >= t[0]) & (ft <= t[-1])
+        close = (ft - t[i_prev] <= tolerance_ms) & (t[i_next] - ft <= tolerance_ms)
+        keep = inside & (close | (t[i_next] == ft))
+
+        merged = frames[keep].copy()
+        ft = ft[keep]
+        # The lap position jumps from 1 back to 0 on the finish line, so it is unwrapped first
+        lap_unwrapped = np.unwrap(telemetry['lap_position'].to_numpy(dtype=float), period=1.0)
+        merged['lap_position'] = np.mod(np.interp(ft, t, lap_unwrapped), 1.0)
+        merged['pos_x'] = np.interp(ft, t, telemetry['pos_x'].to_numpy(dtype=float))
+        merged['pos_y'] = np.interp(ft, t, telemetry['pos_y'].to_numpy(dtype=float))
+    else:
+        raise ValueError(f"Unknown telemetry merge method: {method}")
+
+    dropped = len(frames) - len(merged)
+    if dropped:
+        print(f"{dropped} frames had no telemetry within {tolerance_ms} ms and were left out")
+
+    measured_columns = [col for col in measured_df.columns if col != 'filename']
+    merged = merged.sort_values('timestamp').reset_index(drop=True)
+    return merged[['timestamp'] + TELEMETRY_COLUMNS + ['filename'] + measured_columns]
@@ -0,0 +1,53 @@
+import importlib.util
+import os
+import pandas as pd
+
+# pandas needs pyarrow (requirements.txt) for parquet
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+def split_car_center(measured_df):
+    # measured_data.csv stores the car center as "(x, y)", the analysis works on two integer columns
+    if "car_center" not in measured_df.columns:
+        return measured_df
+
+    center = measured_df["car_center"].astype(str).str.extract(r'\(\s*(-?\d+)\s*,\s*(-?\d+)\s*\)')
+    df = measured_df.drop(columns="car_center")
+    position = list(measured_df.columns).index("car_center")
+    df.insert(position, "car_center_x", pd.to_numeric(center[0]).astype("Int64"))
+    df.insert(position + 1, "car_center_y", pd.to_numeric(center[1]).astype("Int64"))
+    return df
+
+
+def session_table_path(path, pickled=False):
+    return os.path.splitext(path)[0] + (".pkl" if pickled else ".parquet")
+
+
+def save_session_table(df, path, csv_export=False, pickle_fallback=False):
+    # One parquet file per session that keeps the column types, the csv is only an export for reading.
+    # Without pyarrow the table is only pickled when pickle_fallback is set: a pickle is not columnar,
+    # is tied to the Python and pandas versions and is not safe to load from untrusted sources
+    pickled = not HAS_PYARROW
+    if pickled and not pickle_fallback:
+        raise ImportError("Saving the session table as parquet needs pyarrow (pip install -r requirements.txt), "
+                          "pass pickle_fallback=True to pickle it instead")
+
+    table_path = session_table_path(path, pickled)
+    tmp_path = table_path + ".tmp"
+    if pickled:
+        df.to_pickle(tmp_path)
+    else:
+        df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, table_path)
+
+    if csv_export:
+        df.to_csv(os.path.splitext(path)[0] + ".csv", index=False)
+    return table_path
+
+
+def load_session_table(path):
+    # The parquet file, or the pickle of a session saved with pickle_fallback
+    table_path = session_table_path(path)
+    if os.path.exists(table_path) or not os.path.exists(session_table_path(path, pickled=True)):
+        return pd.read_parquet(table_path)
+    return pd.read_pickle(session_table_path(path, pickled=True))
@@ -0,0 +1,86 @@
+import numpy as np
+
+
+class MetricAccumulator:
+    # Running sums for MAPE, R² and Pearson's r that are filled chunk by chunk and can be merged
+    # with the accumulators of other chunks, sessions or processes. The centred moments are combined
+    # with the pairwise update of Chan et al., which stays accurate where sum(x²) - n * mean² would not.
+    # The results match sklearn's mean_absolute_percentage_error / r2_score and scipy's pearsonr.
+    def __init__(self):
+        self.n = 0
+        self.sum_ape = 0.0
+        self.sum_sq_err = 0.0
+        self.mean_true = 0.0
+        self.mean_pred = 0.0
+        # Sums of squared deviations from the means and of their products
+        self.m2_true = 0.0
+        self.m2_pred = 0.0
+        self.c_true_pred = 0.0
+
+    def update(self, y_true, y_pred):
+        y_true = np.asarray(y_true, dtype=float)
+        y_pred = np.asarray(y_pred, dtype=float)
+        if len(y_true) == 0:
+            return self
+
+        chunk = MetricAccumulator()
+        chunk.n = len(y_true)
+        eps = np.finfo(np.float64).eps
+        chunk.sum_ape = float(np.sum(np.abs(y_pred - y_true) / np.maximum(np.abs(y_true), eps)))
+        chunk.sum_sq_err = float(np.sum((y_true - y_pred) ** 2))
+        chunk.mean_true = float(np.mean(y_true))
+        chunk.mean_pred = float(np.mean(y_pred))
+        dev_true = y_true - chunk.mean_true
+        dev_pred = y_pred - chunk.mean_pred
+        chunk.m2_true = float(np.dot(dev_true, dev_true))
+        chunk.m2_pred = float(np.dot(dev_pred, dev_pred))
+        chunk.c_true_pred = float(np.dot(dev_true, dev_pred))
+        return self.merge(chunk)
+
+    def merge(self, other):
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.__dict__.update(other.__dict__)
+            return self
+
+        n = self.n + other.n
+        delta_true = other.mean_true - self.mean_true
+        delta_pred = other.mean_pred - self.mean_pred
+        weight = self.n * other.n / n
+
+        self.m2_true += other.m2_true + delta_true * delta_true * weight
+        self.m2_pred += other.m2_pred + delta_pred * delta_pred * weight
+        self.c_true_pred += other.c_true_pred + delta_true * delta_pred * weight
+        self.mean_true += delta_true * other.n / n
+        self.mean_pred += delta_pred * other.n / n
+        self.sum_ape += other.sum_ape
+        self.sum_sq_err += other.sum_sq_err
+        self.n = n
+        return self
+
+    def mape(self):
+        return self.sum_ape / self.n if self.n else np.nan
+
+    def r2(self):
+        if self.n < 2:
+            return np.nan
+        if self.m2_true == 0:
+            # sklearn's convention for a constant truth
+            return 1.0 if self.sum_sq_err == 0 else 0.0
+        return 1 - self.sum_sq_err / self.m2_true
+
+    def pearson(self):
+        if self.n < 2 or self.m2_true == 0 or self.m2_pred == 0:
+            return np.nan
+        r = self.c_true_pred / np.sqrt(self.m2_true * self.m2_pred)
+        return float(np.clip(r, -1.0, 1.0))
+
+
+def merge_accumulators(groups):
+    # Merges dicts of accumulators (one dict per chunk, session or process) key by key
+    merged = {}
+    for accumulators in groups:
+        for key, accumulator in accumulators.items():
+            merged.setdefault(key, MetricAccumulator()).merge(accumulator)
+    return merged
@@ -0,0 +1,90 @@
+import os
+import time
+import cv2
+import numpy as np
+import pandas as pd
+from functions.preprocessing.preprocessing import enhance_for_matching, locate_car
+from functions.preprocessing.template_bank import load_template_bank
+from config import DATA, IMAGES, TEMPLATE_BANK_CACHE
+
+
+def bbox_iou(bbox_a, bbox_b):
+    if bbox_a is None or bbox_b is None:
+        return 0.0
+    ax1, ay1, ax2, ay2 = bbox_a
+    bx1, by1, bx2, by2 = bbox_b
+    inter_w = max(0, min(ax2, bx2) - max(ax1, bx1))
+    inter_h = max(0, min(ay2, by2) - max(ay1, by1))
+    intersection = inter_w * inter_h
+    union = (ax2 - ax1) * (ay2 - ay1) + (bx2 - bx1) * (by2 - by1) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def compare_search_modes(input_folder, template_folder, report_csv, game_collected_data_csv=None,
+                         pyramid_levels=(2, 3), pyramid_top_k=8, frame_step=1):
+    # Runs the exhaustive search and every pyramid configuration on the same frames and
+    # stores the chosen bounding boxes side by side. Only frames present in the game
+    # collected csv (the labelled frames) are used when it is given.
+    template_bank = load_template_bank(template_folder, os.path.join(DATA, TEMPLATE_BANK_CACHE))
+
+    input_folder_path = os.path.join(DATA, IMAGES, input_folder)
+    filenames = sorted(f for f in os.listdir(input_folder_path) if f.lower().endswith(".png"))
+    if game_collected_data_csv is not None:
+        labelled = set(pd.read_csv(game_collected_data_csv)["filename"].dropna().astype(str))
+        filenames = [f for f in filenames if f in labelled]
+    filenames = filenames[::frame_step]
+
+    rows = []
+    for fname in filenames:
+        img = cv2.imread(os.path.join(input_folder_path, fname))
+        if img is None:
+            continue
+        gray_img = enhance_for_matching(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+
+        start = time.perf_counter()
+        reference = locate_car(gray_img, template_bank)
+        reference_time = time.perf_counter() - start
+        reference_bbox = reference["bbox"] if reference is not None else None
+
+        for levels in pyramid_levels:
+            start = time.perf_counter()
+            match = locate_car(gray_img, template_bank, pyramid_levels=levels, pyramid_top_k=pyramid_top_k)
+            pyramid_time = time.perf_counter() - start
+            pyramid_bbox = match["bbox"] if match is not None else None
+
+            center_distance = np.nan
+            if reference is not None and match is not None:
+                center_distance = float(np.hypot(reference["center"][0] - match["center"][0],
+                                                 reference["center"][1] - match["center"][1]))
+
+            rows.append({
+                "filename": fname,
+                "pyramid_levels": levels,
+                "pyramid_top_k": pyramid_top_k,
+                "exhaustive_bbox": reference_bbox,
+                "pyramid_bbox": pyramid_bbox,
+                "same_bbox": reference_bbox == pyramid_bbox,
+                "iou": bbox_iou(reference_bbox, pyramid_bbox),
+                "center_distance_px": center_distance,
+                "exhaustive_time_s": reference_time,
+                "pyramid_time_s": pyramid_time,
+            })
+
+    report_df = pd.DataFrame(rows)
+    report_df.to_csv(report_csv, index=False)
+
+    if report_df.empty:
+        print("No frames were compared.\n")
+        return report_df
+
+    for levels, group in report_df.groupby("pyramid_levels"):
+        speedup = group["exhaustive_time_s"].sum() / group["pyramid_time_s"].sum()
+        print(f"=== Pyramid levels {levels} (1/{2 ** levels} resolution, top {pyramid_top_k}) ===")
+        print(f"Frames compared: {len(group)}")
+        print(f"Identical bbox: {group['same_bbox'].mean():.2%}")
+        print(f"Mean IoU: {group['iou'].mean():.4f}")
+        print(f"Frames with IoU < 0.5: {int((group['iou'] < 0.5).sum())}")
+        print(f"Median center distance (px): {group['center_distance_px'].median():.2f}")
+        print(f"Speed-up over the exhaustive search: {speedup:.1f}x\n")
+
+    return report_df
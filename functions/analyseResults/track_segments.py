@@ -0,0 +1,106 @@
+import hashlib
+import os
+import numpy as np
+
+STRAIGHT = "straight"
+LEFT_TURN = "left"
+RIGHT_TURN = "right"
+# Position in this tuple is the code stored in the segment index
+ROAD_TYPES = (STRAIGHT, LEFT_TURN, RIGHT_TURN)
+
+# Curvature is measured over the raceline from CURVATURE_WINDOW meters before to as far after each sample
+CURVATURE_WINDOW = 15.0
+# Parts of the track with a larger radius (in meters) count as straights
+STRAIGHT_RADIUS = 250.0
+
+
+class TrackSegments:
+    def __init__(self, codes):
+        # Road type code of every truth sample
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def road_types(self, track_indices):
+        # Road type of every measurement from its closest_track_index
+        return np.asarray(ROAD_TYPES, dtype=object)[self.codes[np.asarray(track_indices, dtype=int)]]
+
+
+def raceline_curvature(truth_df, window=CURVATURE_WINDOW):
+    # Signed curvature (1 / radius) at every truth sample of the closed raceline, positive when the track
+    # bends towards the left border. Taking the side from the borders keeps the sign independent of the
+    # orientation of the game's world axes.
+    x = truth_df['pos_x'].to_numpy(dtype=float)
+    y = truth_df['pos_y'].to_numpy(dtype=float)
+    count = len(x)
+
+    step = np.hypot(np.roll(x, -1) - x, np.roll(y, -1) - y)
+    span = max(1, int(round(window / max(np.median(step), 1e-9))))
+
+    # Heading of the raceline before and after each sample
+    idx = np.arange(count)
+    before = (idx - span) % count
+    after = (idx + span) % count
+    heading_in = np.arctan2(y - y[before], x - x[before])
+    heading_out = np.arctan2(y[after] - y, x[after] - x)
+    turn = np.angle(np.exp(1j * (heading_out - heading_in)))
+
+    # Raceline length from the sample before to the sample after
+    cumulative = np.concatenate([[0.0], np.cumsum(step)])
+    length = (cumulative[idx] - cumulative[before]) % cumulative[-1] + \
+        (cumulative[after] - cumulative[idx]) % cumulative[-1]
+    curvature = turn / np.maximum(length, 1e-9) * 2
+
+    # Which way is left: the side of the direction of travel the left border is on
+    left_x = truth_df['left_border_x'].to_numpy(dtype=float) - x
+    left_y = truth_df['left_border_y'].to_numpy(dtype=float) - y
+    left_side = np.sign((x[after] - x[before]) * left_y - (y[after] - y[before]) * left_x)
+
+    return curvature * np.where(left_side == 0, 1.0, left_side)
+
+
+def label_road_types(truth_df, window=CURVATURE_WINDOW, straight_radius=STRAIGHT_RADIUS):
+    curvature = raceline_curvature(truth_df, window)
+    codes = np.zeros(len(curvature), dtype=np.int8)
+    codes[curvature > 1.0 / straight_radius] = ROAD_TYPES.index(LEFT_TURN)
+    codes[curvature < -1.0 / straight_radius] = ROAD_TYPES.index(RIGHT_TURN)
+    return codes
+
+
+def track_segments_key(truth_csv, window=CURVATURE_WINDOW, straight_radius=STRAIGHT_RADIUS):
+    sha = hashlib.sha1()
+    with open(truth_csv, "rb") as f:
+        sha.update(f.read())
+
+    # Changing the labelling parameters invalidates the cached index
+    sha.update(repr((window, straight_radius)).encode("utf-8"))
+    return sha.hexdigest()
+
+
+def load_track_segments(truth_df, truth_csv, cache_folder=None, window=CURVATURE_WINDOW,
+                        straight_radius=STRAIGHT_RADIUS):
+    # The road types only change with the truth data, so they are labelled once per track and cached
+    track = os.path.splitext(os.path.basename(truth_csv))[0]
+    cache_path = None
+    if cache_folder:
+        key = track_segments_key(truth_csv, window, straight_radius)
+        cache_path = os.path.join(cache_folder, f"{track}_{key}.npy")
+
+    if cache_path and os.path.exists(cache_path):
+        try:
+            codes = np.load(cache_path)
+            if len(codes) == len(truth_df):
+                return TrackSegments(codes)
+        except Exception as e:
+            print(f"Could not read the track segment cache {cache_path}: {e}")
+
+    codes = label_road_types(truth_df, window, straight_radius)
+    if cache_path:
+        os.makedirs(cache_folder, exist_ok=True)
+        # Write to a temporary file first so a parallel run never reads a partial cache
+        tmp_path = cache_path + f".{os.getpid()}.tmp.npy"
+        np.save(tmp_path, codes)
+        os.replace(tmp_path, cache_path)
+
+    return TrackSegments(codes)
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import cv2
+import numpy as np
+
+# A store replaces the frame_<ts>.png files of a session folder with fixed-shape uint8 frames packed
+# back to back into chunk files, plus an index of timestamp -> (chunk, slot). Chunks are read through
+# np.memmap, so a frame is a view of the page cache instead of a decoded copy.
+STORE_HEADER = "store.json"
+STORE_INDEX = "frame_index.csv"
+CHUNK_NAME = "chunk_{:05d}.frames"
+DEFAULT_CHUNK_FRAMES = 256
+
+
+def is_frame_store(folder_path):
+    return os.path.exists(os.path.join(folder_path, STORE_HEADER))
+
+
+def frame_name(timestamp):
+    # Frames in a store keep the names of the png layout, so the csv files and journals stay the same
+    return f"frame_{timestamp}.png"
+
+
+def name_timestamp(fname):
+    return int(os.path.splitext(fname)[0].split("_")[-1])
+
+
+def list_frame_names(folder_path):
+    # Sorted frame names of a session folder in either layout
+    if is_frame_store(folder_path):
+        return FrameStore(folder_path).filenames()
+    return sorted(f for f in os.listdir(folder_path) if f.lower().endswith(".png"))
+
+
+class FrameStoreWriter:
+    def __init__(self, folder_path, chunk_frames=DEFAULT_CHUNK_FRAMES):
+        if is_frame_store(folder_path):
+            raise ValueError(f"{folder_path} already contains a frame store")
+        os.makedirs(folder_path, exist_ok=True)
+        self.folder_path = folder_path
+        self.chunk_frames = chunk_frames
+        self.shape = None
+        self.chunk = -1
+        self.slot = chunk_frames
+        self.chunk_file = None
+        self.index_file = open(os.path.join(folder_path, STORE_INDEX), "a")
+        # Encoder threads of the capture share one writer
+        self.lock = threading.Lock()
+
+    def _write_header(self, frame):
+        self.shape = frame.shape
+        header = {"shape": list(frame.shape), "dtype": "uint8", "chunk_frames": self.chunk_frames}
+        with open(os.path.join(self.folder_path, STORE_HEADER), "w") as f:
+            json.dump(header, f)
+
+    def append(self, timestamp, frame):
+        if frame.dtype != np.uint8:
+            raise ValueError(f"Frame {timestamp} is {frame.dtype}, the store holds uint8 frames")
+        with self.lock:
+            if self.shape is None:
+                self._write_header(frame)
+            elif frame.shape != self.shape:
+                raise ValueError(f"Frame {timestamp} has shape {frame.shape}, the store holds {self.shape}")
+
+            if self.slot == self.chunk_frames:
+                if self.chunk_file is not None:
+                    self.chunk_file.close()
+                self.chunk += 1
+                self.slot = 0
+                self.chunk_file = open(os.path.join(self.folder_path, CHUNK_NAME.format(self.chunk)), "wb")
+
+            self.chunk_file.write(np.ascontiguousarray(frame).data)
+            # The index entry follows the pixels, so an indexed frame is always complete
+            self.chunk_file.flush()
+            self.index_file.write(f"{timestamp},{self.chunk},{self.slot}\n")
+            self.index_file.flush()
+            self.slot += 1
+
+    def close(self):
+        with self.lock:
+            if self.chunk_file is not None:
+                self.chunk_file.close()
+                self.chunk_file = None
+            self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class FrameStore:
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        with open(os.path.join(folder_path, STORE_HEADER)) as f:
+            header = json.load(f)
+        self.shape = tuple(header["shape"])
+        self.frame_bytes = int(np.prod(self.shape))
+
+        self.refresh()
+
+    def refresh(self):
+        # Re-reads the index, picking up frames a running capture appended since the store was opened
+        entries = []
+        with open(os.path.join(self.folder_path, STORE_INDEX)) as f:
+            for line in f:
+                parts = line.strip().split(",")
+                # A capture that was killed can leave a half written last line
+                if len(parts) != 3:
+                    continue
+                try:
+                    entries.append(tuple(int(p) for p in parts))
+                except ValueError:
+                    continue
+        entries.sort()
+
+        self.timestamps = np.array([e[0] for e in entries], dtype=np.int64)
+        self.locations = [(e[1], e[2]) for e in entries]
+        self.positions = {frame_name(ts): i for i, ts in enumerate(self.timestamps.tolist())}
+        # Chunks are mapped again, the last one may have grown
+        self.chunks = {}
+
+    def __len__(self):
+        return len(self.locations)
+
+    def filenames(self):
+        return [frame_name(ts) for ts in self.timestamps.tolist()]
+
+    def _chunk(self, chunk):
+        frames = self.chunks.get(chunk)
+        if frames is None:
+            path = os.path.join(self.folder_path, CHUNK_NAME.format(chunk))
+            count = os.path.getsize(path) // self.frame_bytes
+            frames = np.memmap(path, dtype=np.uint8, mode="r", shape=(count,) + self.shape)
+            self.chunks[chunk] = frames
+        return frames
+
+    def frame(self, position):
+        chunk, slot = self.locations[position]
+        frames = self._chunk(chunk)
+        if slot >= len(frames):
+            # The chunk was mapped before a running capture appended this frame
+            del self.chunks[chunk]
+            frames = self._chunk(chunk)
+        if slot >= len(frames):
+            raise ValueError(f"Frame {self.timestamps[position]} is missing from {CHUNK_NAME.format(chunk)}")
+        # Read-only view into the memory-mapped chunk, no copy is made
+        return frames[slot]
+
+    def read(self, fname):
+        position = self.positions.get(fname)
+        if position is None:
+            self.refresh()
+            position = self.positions.get(fname)
+        if position is None:
+            raise ValueError(f"{fname} is not in the frame store {self.folder_path}")
+        return self.frame(position)
+
+
+def import_png_folder(png_folder_path, store_folder_path, chunk_frames=DEFAULT_CHUNK_FRAMES):
+    # Packs a folder of frame_<ts>.png files into a new frame store
+    fnames = sorted(f for f in os.listdir(png_folder_path) if f.lower().endswith(".png"))
+    with FrameStoreWriter(store_folder_path, chunk_frames) as writer:
+        for fname in fnames:
+            img = cv2.imread(os.path.join(png_folder_path, fname))
+            if img is None:
+                print(f"Skipping unreadable image {fname}")
+                continue
+            writer.append(name_timestamp(fname), img)
+    print(f"Imported {len(fnames)} images into {store_folder_path}")
+
+
+def export_png_folder(store_folder_path, png_folder_path, png_level=3):
+    # Writes every frame of a store back out as frame_<ts>.png
+    store = FrameStore(store_folder_path)
+    os.makedirs(png_folder_path, exist_ok=True)
+    for position, fname in enumerate(store.filenames()):
+        cv2.imwrite(os.path.join(png_folder_path, fname), store.frame(position),
+                    [cv2.IMWRITE_PNG_COMPRESSION, png_level])
+    print(f"Exported {len(store)} frames to {png_folder_path}")
@@ -0,0 +1,58 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+
+def read_frame(path):
+    # Frames stay in the BGR layout cv2.imread decodes them to
+    img = cv2.imread(path)
+    if img is None:
+        raise ValueError(f"Could not read the image {path}")
+    return img
+
+
+def read_frame_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def decode_frame(data, path=""):
+    # Same result as read_frame for the bytes of the file
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Could not read the image {path}")
+    return img
+
+
+def prefetch_frames(items, load, threads=4, depth=8):
+    # Yields (item, frame, error) in the order of items while up to depth frames are read and decoded
+    # ahead on a small thread pool (cv2 releases the GIL while decoding), so disk access and PNG decoding
+    # overlap with the processing of the current frame. threads=0 reads each frame only when it is needed.
+    if threads <= 0:
+        for item in items:
+            try:
+                yield item, load(item), None
+            except Exception as e:
+                yield item, None, e
+        return
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        items = iter(items)
+
+        def submit_next():
+            for item in items:
+                pending.append((item, executor.submit(load, item)))
+                return
+
+        for _ in range(max(1, depth)):
+            submit_next()
+
+        while pending:
+            item, future = pending.popleft()
+            submit_next()
+            try:
+                yield item, future.result(), None
+            except Exception as e:
+                yield item, None, e
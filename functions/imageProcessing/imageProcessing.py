@@ -1,17 +1,38 @@
 import csv
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import cv2
 import numpy as np
-from ..preprocessing.preprocessing import pipeline, mark_edges_of_flat_region, get_hist
-from config import DATA, IMAGES, TEMPLATE_FOLDER
-
-
-def mark_line_intersections_if_car_on_line(binary_img, car_bbox, hist, threshold, min_lane_width):
+from ..preprocessing.preprocessing import pipeline, mark_edges_of_flat_region, get_hist, BAND_HALF_HEIGHT, \
+    ROAD_THRESHOLD, GREEN_HSV_RANGE, YELLOW_HSV_RANGE
+from ..preprocessing.boundary_search import HistogramBoundaries
+from ..preprocessing.template_bank import load_template_bank
+from ..preprocessing.car_tracking import CarTracker
+from ..frameStore.frame_store import FrameStore, is_frame_store, list_frame_names
+from .frame_prefetch import prefetch_frames, read_frame, read_frame_bytes, decode_frame
+from .result_cache import ResultCache, frame_hash, parameters_hash
+from ..analyseResults.calibration import DEFAULT_PIXEL_RATIO, session_pixel_ratio
+from ..instrumentation.instrumentation import FrameTrace, TraceLog, stage, trace_log_path
+from .visualization import VisualizationPolicy, VisualizationWriter, VIS_ALL, VIS_OFF, VIS_VIDEO, VIS_FAILURES
+from ..processedTimestampsLog.frame_journal import frame_journal_path, load_frame_journal, FrameJournal, \
+    FRAME_MEASURED, FRAME_NO_BOUNDARIES, FRAME_FAILED, FINISHED_STATUSES
+from config import DATA, IMAGES, TEMPLATE_BANK_CACHE, RESULT_CACHE
+
+# Minimum histogram value of a boundary line and minimum pixel distance between the two boundaries
+HIST_THRESHOLD = 2
+MIN_LANE_WIDTH = 450
+
+
+def mark_line_intersections_if_car_on_line(binary_img, car_bbox, hist, threshold, min_lane_width, boundaries=None,
+                                           visualize=True, trace=None):
     detected_edge = None
     other_edge_point = None
 
     # Prepare image for drawing
-    vis_img = cv2.cvtColor((binary_img * 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+    vis_img = None
+    if visualize:
+        vis_img = cv2.cvtColor((binary_img * 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
     height, width = binary_img.shape
 
     # Car bounding box
@@ -20,7 +41,8 @@ def mark_line_intersections_if_car_on_line(binary_img, car_bbox, hist, threshold
     car_center_y = (y1 + y2) // 2
 
     # Draw car box
-    cv2.rectangle(vis_img, (x1, y1), (x2, y2), (255, 0, 0), 2)
+    if vis_img is not None:
+        cv2.rectangle(vis_img, (x1, y1), (x2, y2), (255, 0, 0), 2)
 
     # Look for intersection with white line
     pad = 1
@@ -49,11 +71,11 @@ def mark_line_intersections_if_car_on_line(binary_img, car_bbox, hist, threshold
         top_point = closest_to_center(top_hits, top_y)
         bottom_point = closest_to_center(bottom_hits, bot_y)
 
-        if top_point:
+        if vis_img is not None and top_point:
             cv2.circle(vis_img, top_point, 6, (0, 255, 255), -1)  # Yellow
-        if bottom_point:
+        if vis_img is not None and bottom_point:
             cv2.circle(vis_img, bottom_point, 6, (0, 255, 0), -1)  # Green
-        if top_point and bottom_point:
+        if vis_img is not None and top_point and bottom_point:
             avg_x = (top_point[0] + bottom_point[0]) // 2
             avg_y = (top_point[1] + bottom_point[1]) // 2
             mid_point = (avg_x, avg_y)
@@ -61,17 +83,12 @@ def mark_line_intersections_if_car_on_line(binary_img, car_bbox, hist, threshold
 
         detected_edge = determine_detected_edge_position(top_point, bottom_point)
         if detected_edge is not None:
-            found_right = None
-            for x in range(detected_edge[0] + min_lane_width, width):
-                if hist[x] >= threshold:
-                    found_right = x
-                    break
-
-            found_left = None
-            for x in range(detected_edge[0] - min_lane_width, -1, -1):
-                if hist[x] >= threshold:
-                    found_left = x
-                    break
+            if boundaries is None:
+                boundaries = HistogramBoundaries(hist, threshold)
+
+            # Nearest line peaks at least a lane width away on either side
+            found_right = boundaries.nearest_peak_right(detected_edge[0] + min_lane_width)
+            found_left = boundaries.nearest_peak_left(detected_edge[0] - min_lane_width)
 
             # Choose best valid peak
             if found_left and found_right:
@@ -91,9 +108,15 @@ def mark_line_intersections_if_car_on_line(binary_img, car_bbox, hist, threshold
             elif found_right:
                 other_edge_point = (found_right, car_center_y)
 
-            if other_edge_point:
+            if vis_img is not None and other_edge_point:
                 cv2.circle(vis_img, other_edge_point, 6, (0, 165, 255), -1)
 
+    if trace is not None:
+        if detected_edge is None:
+            trace.note(failure="no_line_at_car_edges")
+        elif other_edge_point is None:
+            trace.note(failure="no_line_a_lane_width_away")
+
     if detected_edge is not None and other_edge_point is not None:
         if detected_edge[0] < other_edge_point[0]:
             left_boundary, right_boundary = detected_edge, other_edge_point
@@ -122,53 +145,524 @@ def determine_detected_edge_position(top_point, bottom_point):
         return None
 
 
-def process_image(img_rgb, template_folder):
-    binary_img, car_bbox, car_center = pipeline(img_rgb, TEMPLATE_FOLDER)
+def process_image(img_rgb, template_folder, template_bank=None, car_tracker=None, pyramid_levels=0,
+                  pyramid_top_k=8, roi_only=False, band_half_height=BAND_HALF_HEIGHT, visualize=True, bgr=False, trace=None):
+    # A full-frame binary image is only needed when it is drawn. trace (a FrameTrace) records stage
+    # times and decisions when given
+    frame = analyse_frame(img_rgb, template_folder, template_bank, car_tracker, pyramid_levels, pyramid_top_k,
+                          roi_only and not visualize, band_half_height, bgr, trace)
+
+    left_boundary, right_boundary, vis_img = find_boundaries(frame, visualize, trace)
+
+    return frame["car_center"], left_boundary, right_boundary, vis_img
+
+
+def analyse_frame(img_rgb, template_folder, template_bank=None, car_tracker=None, pyramid_levels=0,
+                  pyramid_top_k=8, roi_only=False, band_half_height=BAND_HALF_HEIGHT, bgr=False, trace=None):
+    binary_img, car_bbox, car_center = pipeline(img_rgb, template_folder, template_bank=template_bank,
+                                                car_tracker=car_tracker, pyramid_levels=pyramid_levels,
+                                                pyramid_top_k=pyramid_top_k, roi_only=roi_only,
+                                                band_half_height=band_half_height, bgr=bgr, trace=trace)
+    if car_bbox is None:
+        raise ValueError("No car was found in the frame")
     x1, y1, x2, y2 = car_bbox
     car_center_x = (x1 + x2) // 2
     car_center_y = (y1 + y2) // 2
     y_range = (max(0, y1), min(binary_img.shape[0], y2))
 
-    hist = get_hist(binary_img, y_range)
+    with stage(trace, "get_hist"):
+        hist = get_hist(binary_img, y_range, band_half_height)
 
-    left_boundary, right_boundary, vis_img = mark_line_intersections(binary_img, car_bbox, hist, 2, y_range, 450)
+    return {
+        "binary_img": binary_img,
+        "car_bbox": car_bbox,
+        "car_center": (car_center_x, car_center_y),
+        "y_range": y_range,
+        "hist": hist,
+    }
 
-    return (car_center_x, car_center_y), left_boundary, right_boundary, vis_img
 
+def find_boundaries(frame, visualize=True, trace=None):
+    with stage(trace, "boundaries"):
+        return mark_line_intersections(frame["binary_img"], frame["car_bbox"], frame["hist"], HIST_THRESHOLD,
+                                       frame["y_range"], MIN_LANE_WIDTH, visualize, trace)
 
-def batch_process_folder(input_folder, output_folder, template_folder, csv_file):
-    os.makedirs(output_folder, exist_ok=True)
 
-    csv_path = csv_file
-    with open(csv_path, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(["filename", "road_width", "distance_left", "distance_right", "car_center"])
+def frame_timestamp(fname):
+    # Frames are saved as "frame_<milliseconds>.png" by the external capture
+    try:
+        return int(os.path.splitext(fname)[0].split("_")[-1])
+    except ValueError:
+        return None
 
-        input_folder_path = os.path.join(DATA, IMAGES, input_folder)
 
-        for i, fname in enumerate(os.listdir(input_folder_path)):
-            if not fname.lower().endswith((".png")):
-                continue
+def detection_params(process_options, tracking):
+    # Everything besides the frame and the template bank that decides a measurement, the result cache key
+    params = dict(process_options)
+    params.update({
+        "tracking": tracking,
+        "threshold": ROAD_THRESHOLD,
+        "green_hsv_range": GREEN_HSV_RANGE,
+        "yellow_hsv_range": YELLOW_HSV_RANGE,
+        "band_half_height": BAND_HALF_HEIGHT,
+        "hist_threshold": HIST_THRESHOLD,
+        "min_lane_width": MIN_LANE_WIDTH,
+    })
+    return params
+
+
+def open_result_cache(template_bank, process_options, tracking):
+    return ResultCache(os.path.join(DATA, RESULT_CACHE, "results.sqlite"),
+                       parameters_hash(template_bank.key, detection_params(process_options, tracking)))
+
+
+def make_car_tracker(process_options):
+    return CarTracker(pyramid_levels=process_options.get("pyramid_levels", 0),
+                      pyramid_top_k=process_options.get("pyramid_top_k", 8))
+
+
+class BatchContext:
+    def __init__(self, input_folder_path, output_folder, template_folder, template_bank, process_options=None,
+                 car_tracker=None, vis_policy=None, vis_writer=None, return_vis=False, decode_threads=4,
+                 instrument=False, pixel_ratio=DEFAULT_PIXEL_RATIO, result_cache=None):
+        self.input_folder_path = input_folder_path
+        self.output_folder = output_folder
+        self.template_folder = template_folder
+        self.template_bank = template_bank
+        # Passed on to process_image
+        self.process_options = process_options or {}
+        self.car_tracker = car_tracker
+        self.vis_policy = vis_policy
+        self.vis_writer = vis_writer
+        # Processed images are handed back to the caller instead of the writer (ordered video from workers)
+        self.return_vis = return_vis
+        # Frames of a frame store are memory-mapped views, only png folders need decoding ahead
+        self.frame_store = FrameStore(input_folder_path) if is_frame_store(input_folder_path) else None
+        # Threads that read and decode upcoming frames ahead of processing
+        self.decode_threads = decode_threads if self.frame_store is None else 0
+        # Record stage times and decisions of every frame
+        self.instrument = instrument
+        # Meters per pixel of the measured widths and distances
+        self.pixel_ratio = pixel_ratio
+        # Earlier measurements of identical frames with the same parameters (a ResultCache)
+        self.result_cache = result_cache
+
+    def read_frame(self, fname):
+        if self.frame_store is not None:
+            return self.frame_store.read(fname)
+        return read_frame(os.path.join(self.input_folder_path, fname))
+
+    def read_frame_data(self, fname):
+        # The undecoded file of a png frame, the pixels themselves for a frame store
+        if self.frame_store is not None:
+            return self.frame_store.read(fname)
+        return read_frame_bytes(os.path.join(self.input_folder_path, fname))
+
+    def decode_frame_data(self, fname, data):
+        if self.frame_store is not None:
+            return data
+        return decode_frame(data, os.path.join(self.input_folder_path, fname))
+
+    def can_use_cached(self, frame_index, fname, result):
+        # A cached result has no processed image. It is served when the frame is not drawn, or when its
+        # processed image was already saved by an earlier run
+        policy = self.vis_policy
+        if policy is None or policy.mode == VIS_OFF:
+            return True
+        # The video needs every frame drawn
+        if policy.mode == VIS_VIDEO:
+            return False
+
+        has_boundaries = result["left_boundary"] is not None and result["right_boundary"] is not None
+        if policy.mode == VIS_FAILURES:
+            # Frames with boundaries are only drawn as outliers, which the earlier run has saved already
+            if has_boundaries:
+                return True
+        elif not policy.wants_frame(frame_index) or not has_boundaries:
+            return True
+        return os.path.exists(os.path.join(self.output_folder, fname))
+
+
+def measurement_row(context, fname, car_center, left_boundary, right_boundary):
+    # The csv row of a frame, the pixel distances are converted to meters
+    ratio = context.pixel_ratio
+    road_width = find_euclidian_distance(left_boundary, right_boundary) * ratio
+    distance_to_left = find_euclidian_distance(car_center, left_boundary) * ratio
+    distance_to_right = find_euclidian_distance(car_center, right_boundary) * ratio
+    return [fname, road_width, distance_to_left, distance_to_right, car_center]
+
+
+def cache_result(car_bbox, car_center, left_boundary, right_boundary):
+    def point(p):
+        return None if p is None else [int(v) for v in p]
+
+    width_px = None
+    if left_boundary is not None and right_boundary is not None:
+        width_px = float(find_euclidian_distance(left_boundary, right_boundary))
+    return {"car_bbox": point(car_bbox), "car_center": point(car_center), "left_boundary": point(left_boundary),
+            "right_boundary": point(right_boundary), "width_px": width_px}
+
+
+def cached_measurement(context, fname, result):
+    # The csv row (None without boundaries) of a cached result
+    if result["left_boundary"] is None or result["right_boundary"] is None:
+        return None
+    return measurement_row(context, fname, tuple(result["car_center"]), tuple(result["left_boundary"]),
+                           tuple(result["right_boundary"]))
+
+
+def measure_frame(context, frame_index, fname, img=None, trace=None, cache_key=None):
+    # Returns the csv row of the frame (None when no road boundaries were found) and, when
+    # context.return_vis is set, the processed image to be saved by the caller.
+    # img is the already decoded BGR frame, it is read from disk when not given. The result is
+    # stored in context.result_cache under cache_key when both are given
+    if context.car_tracker is not None:
+        context.car_tracker.start_frame(frame_timestamp(fname))
+
+    if img is None:
+        img = context.read_frame(fname)
+
+    policy = context.vis_policy
+    visualize = policy is not None and policy.wants_frame(frame_index)
+
+    # A frame that can be saved keeps the full binary image, the ROI-only one is black outside the band
+    options = dict(context.process_options)
+    options["roi_only"] = options.get("roi_only", False) and not (policy is not None and policy.may_draw(frame_index))
+    frame = analyse_frame(img, context.template_folder, context.template_bank, context.car_tracker, bgr=True,
+                          trace=trace, **options)
+    left_boundary, right_boundary, vis_img = find_boundaries(frame, visualize, trace)
+    car_center = frame["car_center"]
+
+    if context.result_cache is not None and cache_key is not None:
+        context.result_cache.put(cache_key, cache_result(frame["car_bbox"], car_center, left_boundary, right_boundary))
+
+    row = None
+    road_width = None
+    if left_boundary is not None and right_boundary is not None:
+        row = measurement_row(context, fname, car_center, left_boundary, right_boundary)
+        road_width = row[1]
+
+    # Frames without boundaries are only part of the video and the failures output
+    if row is None and (policy is None or policy.mode != VIS_VIDEO):
+        vis_img = None
+
+    if policy is not None and policy.wants_result(road_width):
+        _, _, vis_img = find_boundaries(frame, visualize=True)
+
+    if vis_img is None:
+        return row, None
+    if context.return_vis:
+        return row, vis_img
+
+    context.vis_writer.submit(fname, vis_img)
+    return row, None
+
+
+def measure_frames(context, frames):
+    # frames holds (index in the session, filename) pairs. Yields (fname, status, row, vis_img, trace),
+    # trace is the dict of a FrameTrace when context.instrument is set and None otherwise
+    def load(frame):
+        # Returns (frame, cache key, cached result). Cache hits are served without decoding the frame
+        frame_index, fname = frame
+        if context.result_cache is None:
+            return context.read_frame(fname), None, None
+
+        # Frames whose processed image is missing are measured again, their lookup counts as a miss
+        data = context.read_frame_data(fname)
+        key = frame_hash(data)
+        cached = context.result_cache.get(key, lambda result: context.can_use_cached(frame_index, fname, result))
+        if cached is not None:
+            return None, key, cached
+        return context.decode_frame_data(fname, data), key, None
+
+    for (frame_index, fname), loaded, error in prefetch_frames(frames, load, context.decode_threads):
+        trace = FrameTrace() if context.instrument else None
+        # A single broken frame must not stop a run of several hours
+        try:
+            with stage(trace, "total"):
+                if error is not None:
+                    raise error
+                img, cache_key, cached = loaded
+                if cached is not None:
+                    row, vis_img = cached_measurement(context, fname, cached), None
+                    # Keeps the recent widths of the failures mode complete
+                    if context.vis_policy is not None and row is not None:
+                        context.vis_policy.wants_result(row[1])
+                    if trace is not None:
+                        trace.note(cache="hit")
+                    # The tracker did not see this frame, so it starts over with a full search
+                    if context.car_tracker is not None:
+                        context.car_tracker.reset()
+                else:
+                    if trace is not None and cache_key is not None:
+                        trace.note(cache="miss")
+                    row, vis_img = measure_frame(context, frame_index, fname, img, trace, cache_key)
+            status = FRAME_MEASURED if row is not None else FRAME_NO_BOUNDARIES
+        except Exception as e:
+            print(f"Could not process {fname}: {e}")
+            row, vis_img, status = None, None, FRAME_FAILED
+            if trace is not None:
+                trace.note(failure="error", error=str(e))
+        yield fname, status, row, vis_img, trace.as_dict() if trace is not None else None
+
+
+# Per-process state of the batch workers, filled once by _init_batch_worker
+_worker_state = {}
+
+
+def _init_batch_worker(input_folder_path, output_folder, template_folder, options):
+    # Each worker already runs on its own core
+    cv2.setNumThreads(1)
+
+    template_bank = load_template_bank(template_folder, os.path.join(DATA, TEMPLATE_BANK_CACHE))
+    vis_policy = VisualizationPolicy(options["vis_mode"], options["vis_every"])
+    # The video has to be written in frame order, so those images go back to the parent process
+    return_vis = options["vis_mode"] == VIS_VIDEO
+    vis_writer = None
+    if options["vis_mode"] != VIS_OFF and not return_vis:
+        vis_writer = VisualizationWriter(output_folder, options["vis_mode"])
+
+    result_cache = None
+    if options.get("result_cache"):
+        result_cache = open_result_cache(template_bank, options["process"], options["tracking"])
+
+    # One tracker per worker for all its chunks. When the chunks of a worker are not consecutive, the
+    # gap between their timestamps makes the tracker start over with a full search
+    car_tracker = make_car_tracker(options["process"]) if options["tracking"] else None
+
+    _worker_state["context"] = BatchContext(input_folder_path, output_folder, template_folder, template_bank,
+                                            options["process"], car_tracker, vis_policy=vis_policy,
+                                            vis_writer=vis_writer,
+                                            return_vis=return_vis, decode_threads=options["decode_threads"],
+                                            instrument=options.get("instrument", False),
+                                            pixel_ratio=options.get("pixel_ratio", DEFAULT_PIXEL_RATIO),
+                                            result_cache=result_cache)
+
+
+def _process_frame_chunk(frames):
+    context = _worker_state["context"]
+    car_tracker = context.car_tracker
+    tracker_before = car_tracker.counts() if car_tracker is not None else None
+    result_cache = context.result_cache
+    cache_before = result_cache.counts() if result_cache is not None else None
+
+    results = list(measure_frames(context, frames))
+
+    # The chunk only counts as done once its processed images are on disk
+    if context.vis_writer is not None:
+        context.vis_writer.wait()
+
+    cache_counts = None
+    if result_cache is not None:
+        result_cache.flush()
+        cache_counts = {name: count - cache_before[name] for name, count in result_cache.counts().items()}
+
+    # Only the counts of this chunk, the parent adds up those of all chunks
+    tracker_counts = None
+    if car_tracker is not None:
+        tracker_counts = tuple(count - before for count, before in zip(car_tracker.counts(), tracker_before))
+    return results, tracker_counts, cache_counts
+
+
+def bounded_map(executor, fn, items, max_in_flight):
+    # Like executor.map, but only max_in_flight items are submitted or waiting to be consumed at a time,
+    # so finished results (e.g. processed images of the video) do not pile up in memory while the oldest
+    # item is still running. Yields the results in the order of items
+    items = iter(items)
+    in_flight = deque()
+
+    def submit_next():
+        for item in items:
+            in_flight.append(executor.submit(fn, item))
+            return
+
+    for _ in range(max(1, max_in_flight)):
+        submit_next()
+
+    while in_flight:
+        result = in_flight.popleft().result()
+        submit_next()
+        yield result
+
+
+def measure_frames_parallel(context, frames, workers, chunk_size, vis_mode=VIS_ALL, vis_every=25, max_in_flight=None):
+    # At most max_in_flight chunks (2 per worker by default) are submitted or waiting to be consumed
+    options = {
+        "tracking": context.car_tracker is not None,
+        "process": context.process_options,
+        "vis_mode": vis_mode,
+        "vis_every": vis_every,
+        # One or two decode threads per worker are enough to hide its reads
+        "decode_threads": min(2, context.decode_threads),
+        "instrument": context.instrument,
+        "pixel_ratio": context.pixel_ratio,
+        "result_cache": context.result_cache is not None,
+    }
+    chunks = [frames[i:i + chunk_size] for i in range(0, len(frames), chunk_size)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(context.input_folder_path, context.output_folder, context.template_folder,
+                                       options)) as executor:
+        # Results come in submission order, so they keep the filename order
+        for results, tracker_counts, cache_counts in bounded_map(executor, _process_frame_chunk, chunks,
+                                                                 max_in_flight or 2 * workers):
+            if context.car_tracker is not None and tracker_counts is not None:
+                context.car_tracker.add_counts(tracker_counts)
+            if context.result_cache is not None and cache_counts is not None:
+                context.result_cache.add_counts(cache_counts)
+            yield from results
+
+
+def read_measured_filenames(csv_file):
+    with open(csv_file, newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)
+        return {row[0] for row in reader if row}
+
+
+class SessionOutput:
+    # The measured csv, the frame journal and the trace log of a session, written the same way by
+    # batch_process_folder and live_process_folder
+    def __init__(self, csv_path, resume, instrument=False, vis_writer=None):
+        self.file = open(csv_path, mode='a' if resume else 'w', newline='')
+        self.writer = csv.writer(self.file)
+        if not resume:
+            self.writer.writerow(["filename", "road_width", "distance_left", "distance_right", "car_center"])
+            self.file.flush()
+        self.journal = FrameJournal(frame_journal_path(csv_path), resume)
+        self.trace_log = TraceLog(trace_log_path(csv_path), resume) if instrument else None
+        # Receives the processed images that measure_frames hands back (video from the workers)
+        self.vis_writer = vis_writer
+        self.processed = 0
+        self.failed = 0
+
+    def record(self, fname, status, row, vis_img, trace):
+        # Takes one result of measure_frames
+        if vis_img is not None and self.vis_writer is not None:
+            self.vis_writer.submit(fname, vis_img)
+        if trace is not None and self.trace_log is not None:
+            self.trace_log.record(fname, status, trace)
+        if row is not None:
+            self.writer.writerow(row)
+        # The row is on disk before the journal says the frame is done
+        self.file.flush()
+        self.journal.record(fname, status)
+        self.journal.flush()
+
+        self.processed += 1
+        if status == FRAME_FAILED:
+            self.failed += 1
+
+    def mark_complete(self):
+        self.journal.mark_complete()
+
+    def close(self):
+        self.file.close()
+        self.journal.close()
+        if self.trace_log is not None:
+            self.trace_log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def batch_process_folder(input_folder, output_folder, template_folder, csv_file, tracking=False, pyramid_levels=0,
+                         pyramid_top_k=8, workers=1, chunk_size=32, roi_only=False, vis_mode=VIS_ALL, vis_every=25,
+                         decode_threads=4, instrument=False, pixel_ratio=None, result_cache=True, reprocess=False):
+    # vis_mode: "all" saves every measured frame, "off" none, "every_n" every vis_every-th frame, "failures"
+    # frames without boundaries or with outlier widths, "video" one processed.mp4 instead of separate images.
+    # instrument records stage times and decisions of every frame in <csv>_trace.jsonl and prints a summary.
+    # pixel_ratio converts the pixel distances to meters (the calibrated ratio of the track, see calibration.py).
+    # result_cache reuses the results of identical frames measured with the same parameters before, frames
+    # that are not drawn are then served without decoding them.
+    # A session whose journal is marked complete is not processed again unless reprocess is set, which
+    # starts the csv and the journal over
+    os.makedirs(output_folder, exist_ok=True)
 
-            img_path = os.path.join(input_folder_path, fname)
-            img = cv2.imread(img_path)
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    # The template variants are identical for every frame, so they are prepared once per run
+    # (this also fills the on-disk cache that the parallel workers load from)
+    template_bank = load_template_bank(template_folder, os.path.join(DATA, TEMPLATE_BANK_CACHE))
 
-            car_center, left_boundary, right_boundary, vis_img = process_image(img_rgb, template_folder)
+    input_folder_path = os.path.join(DATA, IMAGES, input_folder)
 
-            if left_boundary is not None and right_boundary is not None:
-                ratio = 0.018871954437029596 # ground truth ratio for Nurburgring GP track
-                road_width = find_euclidian_distance(left_boundary, right_boundary) * ratio
-                distance_to_left = find_euclidian_distance(car_center, left_boundary) * ratio
-                distance_to_right = find_euclidian_distance(car_center, right_boundary) * ratio
+    # Sorted so that consecutive frames follow each other in time (png files or a frame store)
+    fnames = list_frame_names(input_folder_path)
 
-                writer.writerow([fname, road_width, distance_to_left, distance_to_right, car_center])
+    process_options = {"pyramid_levels": pyramid_levels, "pyramid_top_k": pyramid_top_k, "roi_only": roi_only}
 
-                save_path = os.path.join(output_folder, fname)
-                cv2.imwrite(save_path, vis_img)
+    # Consecutive frames are 100 ms apart, so the previous car position narrows the search
+    car_tracker = make_car_tracker(process_options) if tracking else None
 
+    csv_path = csv_file
 
-def mark_line_intersections(binary_img, car_bbox, hist, threshold, y_range, min_lane_width):
+    # Frames finished by an earlier, interrupted run are skipped and their rows kept
+    journal_path = frame_journal_path(csv_path)
+    statuses, session_complete = load_frame_journal(journal_path)
+    if reprocess:
+        statuses, session_complete = {}, False
+    elif session_complete and os.path.exists(csv_path):
+        print(f"{input_folder} is already completely processed, pass reprocess=True to process it again")
+        return True
+    resume = bool(statuses) and os.path.exists(csv_path)
+
+    finished = set()
+    if resume:
+        finished = {fname for fname, status in statuses.items() if status in FINISHED_STATUSES}
+        # A row can reach the csv just before a crash prevents its journal entry
+        finished |= read_measured_filenames(csv_path)
+        print(f"Resuming {input_folder}: {len(finished & set(fnames))} of {len(fnames)} frames already processed")
+
+    # All rows of a session use the same ratio, also when it is resumed after a new calibration
+    pixel_ratio = session_pixel_ratio(csv_path, resume, pixel_ratio)
+
+    pending = [(i, fname) for i, fname in enumerate(fnames) if fname not in finished]
+    output = None
+
+    # Processed images are encoded on a background thread while the next frame is measured
+    vis_writer = VisualizationWriter(output_folder, vis_mode) if vis_mode != VIS_OFF else None
+    cache = open_result_cache(template_bank, process_options, tracking) if result_cache else None
+    context = BatchContext(input_folder_path, output_folder, template_folder, template_bank, process_options,
+                           car_tracker, VisualizationPolicy(vis_mode, vis_every), vis_writer,
+                           decode_threads=decode_threads, instrument=instrument, pixel_ratio=pixel_ratio,
+                           result_cache=cache)
+
+    try:
+        with SessionOutput(csv_path, resume, instrument, vis_writer) as output:
+            if workers > 1:
+                results = measure_frames_parallel(context, pending, workers, chunk_size, vis_mode, vis_every)
+            else:
+                results = measure_frames(context, pending)
+
+            for result in results:
+                output.record(*result)
+
+            # Failed frames are retried on the next run, so only a run without failures completes the session
+            complete = output.failed == 0
+            if complete:
+                output.mark_complete()
+    finally:
+        if vis_writer is not None:
+            vis_writer.close()
+        if cache is not None:
+            cache.close()
+
+    if car_tracker is not None:
+        print(car_tracker.summary())
+    if cache is not None:
+        print(cache.summary())
+    if output is not None and output.trace_log is not None:
+        print(output.trace_log.summary())
+    if output is not None and output.failed:
+        print(f"{output.failed} frames could not be processed and will be retried on the next run")
+
+    return complete
+
+
+def mark_line_intersections(binary_img, car_bbox, hist, threshold, y_range, min_lane_width, visualize=True,
+                            trace=None):
     # Check if car is intersecting a line
     x1, y1, x2, y2 = car_bbox
     car_center_x = (x1 + x2) // 2
@@ -181,16 +675,22 @@ def mark_line_intersections(binary_img, car_bbox, hist, threshold, y_range, min_
 
     car_region = binary_img[y1e:y2e, x1e:x2e]
 
-    left_slice = hist[car_center_x - min_lane_width:car_center_x]
-    has_activity_left = np.any(left_slice > threshold)
-
-    right_slice = hist[car_center_x:car_center_x + min_lane_width]
-    has_activity_right = np.any(right_slice > threshold)
-
-    if np.any(car_region == 1):
-        if has_activity_left and has_activity_right:
-            return mark_edges_of_flat_region(binary_img, car_bbox, hist, threshold, y_range, min_lane_width)
-        else:
-            return mark_line_intersections_if_car_on_line(binary_img, car_bbox, hist, threshold, min_lane_width)
-    else:
-        return mark_edges_of_flat_region(binary_img, car_bbox, hist, threshold, y_range, min_lane_width)
+    # Threshold crossings and flat regions of the histogram are found once and shared by both branches
+    boundaries = HistogramBoundaries(hist, threshold)
+
+    has_activity_left = boundaries.has_activity(car_center_x - min_lane_width, car_center_x)
+    has_activity_right = boundaries.has_activity(car_center_x, car_center_x + min_lane_width)
+
+    if np.any(car_region == 1) and not (has_activity_left and has_activity_right):
+        if trace is not None:
+            trace.note(branch="car_on_line")
+        return mark_line_intersections_if_car_on_line(binary_img, car_bbox, hist, threshold, min_lane_width,
+                                                      boundaries, visualize, trace)
+
+    if trace is not None:
+        trace.note(branch="flat_region")
+    left_boundary, right_boundary, vis_img = mark_edges_of_flat_region(binary_img, car_bbox, hist, threshold, y_range,
+                                                                       min_lane_width, boundaries, visualize)
+    if trace is not None and left_boundary is None:
+        trace.note(failure="no_flat_region_between_lines")
+    return left_boundary, right_boundary, vis_img
@@ -0,0 +1,177 @@
+import bisect
+import os
+import queue
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from .imageProcessing import read_measured_filenames, _init_batch_worker, _process_frame_chunk, SessionOutput
+from .visualization import VisualizationWriter, VIS_OFF, VIS_VIDEO
+from ..analyseResults.calibration import session_pixel_ratio
+from ..frameStore.frame_store import is_frame_store, list_frame_names
+from ..preprocessing.template_bank import load_template_bank
+from ..processedTimestampsLog.frame_journal import frame_journal_path, load_frame_journal, FINISHED_STATUSES
+from config import DATA, IMAGES, TEMPLATE_BANK_CACHE
+
+
+class FolderWatcher:
+    # Polls a session folder for frames the capture has finished writing. A png counts as finished
+    # once its size is the same in two polls in a row; a frame store only indexes complete frames.
+    def __init__(self, folder_path, ignore=()):
+        self.folder_path = folder_path
+        self.seen = set(ignore)
+        self.sizes = {}
+
+    def poll(self):
+        if not os.path.isdir(self.folder_path):
+            return []
+        if is_frame_store(self.folder_path):
+            ready = [f for f in list_frame_names(self.folder_path) if f not in self.seen]
+        else:
+            ready = []
+            for fname in sorted(os.listdir(self.folder_path)):
+                if not fname.lower().endswith(".png") or fname in self.seen:
+                    continue
+                try:
+                    size = os.path.getsize(os.path.join(self.folder_path, fname))
+                except OSError:
+                    continue
+                if size > 0 and self.sizes.get(fname) == size:
+                    ready.append(fname)
+                    del self.sizes[fname]
+                else:
+                    self.sizes[fname] = size
+        self.seen.update(ready)
+        return ready
+
+
+class QueueSource:
+    # Takes frame names from an in-process queue (e.g. filled by the on_saved callback of run_capture),
+    # None marks the end of the session
+    def __init__(self, frame_queue, ignore=()):
+        self.frame_queue = frame_queue
+        self.ignore = set(ignore)
+        self.ended = False
+
+    def poll(self):
+        ready = []
+        while True:
+            try:
+                fname = self.frame_queue.get_nowait()
+            except queue.Empty:
+                return ready
+            if fname is None:
+                self.ended = True
+                return ready
+            fname = os.path.basename(fname)
+            if fname not in self.ignore:
+                ready.append(fname)
+
+
+def live_process_folder(input_folder, output_folder, template_folder, csv_file, tracking=False, pyramid_levels=0,
+                        pyramid_top_k=8, workers=2, chunk_size=4, roi_only=False, vis_mode=VIS_OFF, vis_every=25,
+                        poll_interval=0.5, max_latency=2.0, max_in_flight=None, idle_timeout=60,
+                        status_interval=10, frame_queue=None, instrument=False, pixel_ratio=None):
+    # Measures the frames of a session while it is still being captured. New frames are handed to a
+    # pool of worker processes in chunks of chunk_size (or sooner when the oldest has waited max_latency
+    # seconds) and their rows are appended to csv_file in the order they were found. At most
+    # max_in_flight chunks are queued at the workers: when processing falls behind the remaining frames
+    # wait as filenames until a worker is free, so memory stays bounded while the backlog is reported.
+    # Uses the same journal as batch_process_folder, so running main.py afterwards only processes what
+    # is left. The car detection settings (tracking, pyramid_levels, pyramid_top_k) must match those of the
+    # batch run, the defaults are the same. A frame gets the index of its position in the sorted filenames,
+    # like in batch_process_folder, which is exact as long as the frames are found in filename order (the
+    # capture names them by timestamp). Stops after idle_timeout seconds without new frames, at the end of
+    # frame_queue or on Ctrl+C.
+    os.makedirs(output_folder, exist_ok=True)
+    load_template_bank(template_folder, os.path.join(DATA, TEMPLATE_BANK_CACHE))
+
+    input_folder_path = os.path.join(DATA, IMAGES, input_folder)
+    process_options = {"pyramid_levels": pyramid_levels, "pyramid_top_k": pyramid_top_k, "roi_only": roi_only}
+    options = {
+        "tracking": tracking,
+        "process": process_options,
+        "vis_mode": vis_mode,
+        "vis_every": vis_every,
+        "decode_threads": 1,
+        "instrument": instrument,
+    }
+    max_in_flight = max_in_flight or 2 * workers
+
+    journal_path = frame_journal_path(csv_file)
+    statuses, _ = load_frame_journal(journal_path)
+    resume = bool(statuses) and os.path.exists(csv_file)
+    finished = set()
+    if resume:
+        finished = {fname for fname, status in statuses.items() if status in FINISHED_STATUSES}
+        finished |= read_measured_filenames(csv_file)
+    options["pixel_ratio"] = session_pixel_ratio(csv_file, resume, pixel_ratio)
+
+    if frame_queue is not None:
+        source = QueueSource(frame_queue, finished)
+    else:
+        source = FolderWatcher(input_folder_path, finished)
+
+    # (index in the session, filename, time it was found)
+    backlog = deque()
+    in_flight = deque()
+    # Sorted filenames of the session found so far, a frame's position in it is its index
+    session_frames = sorted(finished)
+    last_frame_time = last_status_time = time.monotonic()
+
+    # The workers save the processed images themselves, only the video is written here in frame order
+    video_writer = VisualizationWriter(output_folder, vis_mode) if vis_mode == VIS_VIDEO else None
+
+    print(f"Live processing of {input_folder_path} with {workers} workers, stop with Ctrl+C")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(input_folder_path, output_folder, template_folder, options)) as executor, \
+            SessionOutput(csv_file, resume, instrument, video_writer) as output:
+        try:
+            while True:
+                now = time.monotonic()
+                for fname in source.poll():
+                    frame_index = bisect.bisect_left(session_frames, fname)
+                    session_frames.insert(frame_index, fname)
+                    backlog.append((frame_index, fname, now))
+                    last_frame_time = now
+
+                ended = getattr(source, "ended", False) or now - last_frame_time >= idle_timeout
+
+                # Backpressure: new chunks only go out while fewer than max_in_flight are queued
+                while backlog and len(in_flight) < max_in_flight and (
+                        len(backlog) >= chunk_size or now - backlog[0][2] >= max_latency or ended):
+                    chunk = [backlog.popleft() for _ in range(min(chunk_size, len(backlog)))]
+                    frames = [(index, fname) for index, fname, _ in chunk]
+                    in_flight.append(executor.submit(_process_frame_chunk, frames))
+
+                # Rows are written in submission order, as soon as the oldest chunk is done
+                while in_flight and in_flight[0].done():
+                    results, _, _ = in_flight.popleft().result()
+                    for result in results:
+                        output.record(*result)
+
+                if ended and not backlog and not in_flight:
+                    break
+
+                if now - last_status_time >= status_interval:
+                    lag = now - backlog[0][2] if backlog else 0.0
+                    print(f"Processed {output.processed} frames, {len(backlog)} waiting, "
+                          f"{len(in_flight)} chunks at the workers, oldest waiting {lag:.1f} s")
+                    last_status_time = now
+
+                if in_flight:
+                    # Wakes up as soon as the oldest chunk is done
+                    wait([in_flight[0]], timeout=poll_interval)
+                else:
+                    time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            print("Live processing stopped, the remaining frames are processed by the next run of main.py")
+            for future in in_flight:
+                future.cancel()
+        finally:
+            if video_writer is not None:
+                video_writer.close()
+
+    if output.trace_log is not None:
+        print(output.trace_log.summary())
+    print(f"Live processing finished: {output.processed} frames processed, {output.failed} failed\n")
+    return output.processed, output.failed
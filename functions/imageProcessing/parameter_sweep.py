@@ -0,0 +1,172 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import pandas as pd
+from .imageProcessing import mark_line_intersections, find_euclidian_distance, bounded_map, HIST_THRESHOLD, \
+    MIN_LANE_WIDTH
+from .frame_prefetch import prefetch_frames, read_frame
+from ..analyseResults.analyse_results import grouped_metrics, MAX_MAPE
+from ..analyseResults.calibration import DEFAULT_PIXEL_RATIO
+from ..frameStore.frame_store import FrameStore, is_frame_store, list_frame_names
+from ..preprocessing.preprocessing import template_matching, roi_binary, get_hist, to_gray, ROAD_THRESHOLD, \
+    GREEN_HSV_RANGE, YELLOW_HSV_RANGE, BAND_HALF_HEIGHT
+from ..preprocessing.template_bank import load_template_bank
+from config import DATA, TEMPLATE_BANK_CACHE
+
+# Parameters a sweep can vary, with the values batch_process_folder uses
+SWEEP_DEFAULTS = {
+    "threshold": ROAD_THRESHOLD,
+    "green_hsv_range": GREEN_HSV_RANGE,
+    "yellow_hsv_range": YELLOW_HSV_RANGE,
+    "hist_threshold": HIST_THRESHOLD,
+    "min_lane_width": MIN_LANE_WIDTH,
+}
+# Parameters that change the binary image, the others only change the boundary search on its histogram
+BINARY_PARAMS = ("threshold", "green_hsv_range", "yellow_hsv_range")
+
+
+def parameter_grid(grid):
+    # grid maps parameter names to lists of values, parameters that are left out keep their default.
+    # Returns one dict per combination
+    unknown = set(grid) - set(SWEEP_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}, expected some of {list(SWEEP_DEFAULTS)}")
+
+    names = list(SWEEP_DEFAULTS)
+    values = [grid.get(name, [SWEEP_DEFAULTS[name]]) for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def sweep_frame(img, template_bank, configs, pyramid_levels=0, pyramid_top_k=8):
+    # Measures one BGR frame with every configuration. The car is located once, the gray and HSV planes
+    # are converted once, and every binary image is built once for all configurations that share it.
+    # The car search settings default to those of batch_process_folder, so the configurations are ranked on
+    # the same car boxes. Returns one (road width, distance left, distance right) in pixels per configuration,
+    # None without boundaries
+    gray = to_gray(img, bgr=True)
+    _, car_bbox, _ = template_matching(img, None, template_bank=template_bank, pyramid_levels=pyramid_levels,
+                                       pyramid_top_k=pyramid_top_k, gray=gray)
+    if car_bbox is None:
+        raise ValueError("No car was found in the frame")
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+
+    # Same car center and histogram rows as analyse_frame
+    x1, y1, x2, y2 = car_bbox
+    car_center = ((x1 + x2) // 2, (y1 + y2) // 2)
+    y_range = (max(0, y1), min(img.shape[0], y2))
+
+    # Only the histogram band and the car region are read by the boundary search
+    histograms = {}
+    results = []
+    for config in configs:
+        binary_key = tuple(config[name] for name in BINARY_PARAMS)
+        if binary_key not in histograms:
+            binary_img = roi_binary(img, gray, car_bbox, config["threshold"], BAND_HALF_HEIGHT, bgr=True, hsv=hsv,
+                                    green_range=config["green_hsv_range"], yellow_range=config["yellow_hsv_range"])
+            histograms[binary_key] = binary_img, get_hist(binary_img, y_range, BAND_HALF_HEIGHT)
+        binary_img, hist = histograms[binary_key]
+
+        left_boundary, right_boundary, _ = mark_line_intersections(binary_img, car_bbox, hist,
+                                                                   config["hist_threshold"], y_range,
+                                                                   config["min_lane_width"], visualize=False)
+        if left_boundary is None or right_boundary is None:
+            results.append(None)
+        else:
+            results.append((find_euclidian_distance(left_boundary, right_boundary),
+                            find_euclidian_distance(car_center, left_boundary),
+                            find_euclidian_distance(car_center, right_boundary)))
+    return results
+
+
+# Per-process state of the sweep workers, filled once by _init_sweep_worker
+_sweep_state = {}
+
+
+def _init_sweep_worker(input_folder_path, template_folder, configs, pyramid_levels, pyramid_top_k):
+    # Each worker already runs on its own core
+    cv2.setNumThreads(1)
+    _sweep_state["input_folder_path"] = input_folder_path
+    _sweep_state["frame_store"] = FrameStore(input_folder_path) if is_frame_store(input_folder_path) else None
+    _sweep_state["template_bank"] = load_template_bank(template_folder, os.path.join(DATA, TEMPLATE_BANK_CACHE))
+    _sweep_state["configs"] = configs
+    _sweep_state["pyramid"] = (pyramid_levels, pyramid_top_k)
+
+
+def _sweep_frames(fnames):
+    frame_store = _sweep_state["frame_store"]
+
+    def load(fname):
+        if frame_store is not None:
+            return frame_store.read(fname)
+        return read_frame(os.path.join(_sweep_state["input_folder_path"], fname))
+
+    rows = []
+    # Frames of a store are memory-mapped, only png files are decoded ahead
+    for fname, img, error in prefetch_frames(fnames, load, threads=0 if frame_store is not None else 2):
+        try:
+            if error is not None:
+                raise error
+            results = sweep_frame(img, _sweep_state["template_bank"], _sweep_state["configs"],
+                                  *_sweep_state["pyramid"])
+        except Exception as e:
+            print(f"Could not process {fname}: {e}")
+            continue
+        for config_id, result in enumerate(results):
+            if result is not None:
+                rows.append((fname, config_id) + tuple(float(v) for v in result))
+    return rows
+
+
+def sweep_folder(input_folder_path, template_folder, configs, frame_step=1, workers=1, chunk_size=16,
+                 pyramid_levels=0, pyramid_top_k=8, max_in_flight=None):
+    # Measures every frame_step-th frame of a session with every configuration. Returns one row per frame and
+    # configuration that found both boundaries: filename, config, width_px, distance_left_px, distance_right_px.
+    # At most max_in_flight chunks (2 per worker by default) are submitted or waiting to be collected
+    load_template_bank(template_folder, os.path.join(DATA, TEMPLATE_BANK_CACHE))
+    fnames = list_frame_names(input_folder_path)[::frame_step]
+    chunks = [fnames[i:i + chunk_size] for i in range(0, len(fnames), chunk_size)]
+    init_args = (input_folder_path, template_folder, configs, pyramid_levels, pyramid_top_k)
+
+    rows = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker,
+                                 initargs=init_args) as executor:
+            # Same bounded submission as measure_frames_parallel, the chunks are collected in order
+            for chunk_rows in bounded_map(executor, _sweep_frames, chunks, max_in_flight or 2 * workers):
+                rows.extend(chunk_rows)
+    else:
+        _init_sweep_worker(*init_args)
+        for chunk in chunks:
+            rows.extend(_sweep_frames(chunk))
+
+    print(f"Swept {len(fnames)} frames with {len(configs)} configurations")
+    return pd.DataFrame(rows, columns=["filename", "config", "width_px", "distance_left_px", "distance_right_px"])
+
+
+def rank_configurations(measurements, truth_df, configs, pixel_ratio=DEFAULT_PIXEL_RATIO, max_mape=MAX_MAPE):
+    # truth_df holds the truth_width of every swept frame (filename, truth_width), e.g. from map_measured_to_truth.
+    # Like evaluate_predictions, frames with a MAPE of max_mape or more are left out of the metrics.
+    # coverage is the share of the frames with a truth width that the configuration measured and kept.
+    # The configurations are ranked on all of those frames: ranking_mape counts every frame a configuration
+    # missed or rejected with max_mape, the smallest error a rejected frame can have, so a configuration that
+    # only gets a few frames right does not rank above one that measures every frame decently.
+    # Returns one row per configuration, best (lowest ranking_mape) first
+    df = measurements.merge(truth_df[["filename", "truth_width"]], on="filename", how="inner")
+    df["road_width"] = df["width_px"] * pixel_ratio
+    df = df[(df["road_width"] - df["truth_width"]).abs() / df["truth_width"] < max_mape]
+
+    metrics = grouped_metrics(df, "config").reindex(range(len(configs)))
+    metrics["frames"] = metrics["frames"].fillna(0).astype(int)
+    truth_frames = max(1, truth_df["filename"].nunique())
+    metrics["coverage"] = metrics["frames"] / truth_frames
+    kept_ape = (metrics["mape"] * metrics["frames"]).fillna(0.0)
+    metrics["ranking_mape"] = (kept_ape + max_mape * (truth_frames - metrics["frames"])) / truth_frames
+
+    table = pd.DataFrame(configs)
+    for name in ("green_hsv_range", "yellow_hsv_range"):
+        table[name] = table[name].map(str)
+    table = pd.concat([table, metrics.reset_index(drop=True)], axis=1)
+    table.insert(0, "config", range(len(configs)))
+    return table.sort_values(["ranking_mape", "r2"], ascending=[True, False],
+                             na_position="last").reset_index(drop=True)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Bump when the measurement changes in a way the detection parameters do not capture
+RESULT_CACHE_VERSION = 1
+
+
+def frame_hash(data):
+    # data is the encoded file (bytes) or the raw pixels of a frame store (a contiguous array)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def parameters_hash(template_bank_key, params):
+    sha = hashlib.sha1()
+    sha.update(template_bank_key.encode("utf-8"))
+    sha.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    sha.update(str(RESULT_CACHE_VERSION).encode("utf-8"))
+    return sha.hexdigest()
+
+
+class ResultCache:
+    # Measurement results in a sqlite file, keyed by frame content hash and parameters hash. Entries are
+    # evicted least recently used first once the cache holds more than max_entries results. Safe to share
+    # between threads; several processes can use the same file, sqlite serialises their writes.
+    def __init__(self, path, params_key, max_entries=500000, commit_every=64):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.params_key = params_key
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                frame_hash TEXT NOT NULL,
+                params_hash TEXT NOT NULL,
+                result TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (frame_hash, params_hash)
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.connection.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        # Writes and last-used updates are committed in batches
+        self.pending_writes = 0
+        self.pending_touches = []
+
+    def get(self, key, usable=None):
+        # usable decides whether a stored result can be served, a result that is not counts as a miss
+        with self.lock:
+            row = self.connection.execute("SELECT result FROM results WHERE frame_hash = ? AND params_hash = ?",
+                                          (key, self.params_key)).fetchone()
+            result = json.loads(row[0]) if row is not None else None
+            if result is None or (usable is not None and not usable(result)):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.pending_touches.append((time.time(), key, self.params_key))
+            self._maybe_commit()
+            return result
+
+    def put(self, key, result):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                                    (key, self.params_key, json.dumps(result), time.time()))
+            self.stored += 1
+            self.pending_writes += 1
+            self._maybe_commit()
+
+    def flush(self):
+        with self.lock:
+            self._commit()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def counts(self):
+        return {"hits": self.hits, "misses": self.misses, "stored": self.stored, "evicted": self.evicted}
+
+    def add_counts(self, counts):
+        # Merges the counts of a worker's cache
+        self.hits += counts["hits"]
+        self.misses += counts["misses"]
+        self.stored += counts["stored"]
+        self.evicted += counts["evicted"]
+
+    def summary(self):
+        looked_up = self.hits + self.misses
+        rate = self.hits / looked_up * 100 if looked_up else 0.0
+        return (f"Result cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate), "
+                f"{self.stored} stored, {self.evicted} evicted")
+
+    def _maybe_commit(self):
+        if self.pending_writes + len(self.pending_touches) >= self.commit_every:
+            self._commit()
+
+    def _commit(self):
+        if self.pending_touches:
+            self.connection.executemany("UPDATE results SET last_used = ? WHERE frame_hash = ? AND params_hash = ?",
+                                        self.pending_touches)
+            self.pending_touches = []
+        if self.pending_writes:
+            self._evict()
+            self.pending_writes = 0
+        self.connection.commit()
+
+    def _evict(self):
+        count = self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self.connection.execute("DELETE FROM results WHERE rowid IN "
+                                    "(SELECT rowid FROM results ORDER BY last_used LIMIT ?)", (excess,))
+            self.evicted += excess
@@ -0,0 +1,105 @@
+import os
+import queue
+import threading
+from collections import deque
+import cv2
+import numpy as np
+
+VIS_ALL = "all"
+VIS_OFF = "off"
+VIS_EVERY_N = "every_n"
+VIS_FAILURES = "failures"
+VIS_VIDEO = "video"
+VIS_MODES = (VIS_ALL, VIS_OFF, VIS_EVERY_N, VIS_FAILURES, VIS_VIDEO)
+
+
+class VisualizationPolicy:
+    def __init__(self, mode=VIS_ALL, every_n=25, outlier_tolerance=0.3, history=25):
+        if mode not in VIS_MODES:
+            raise ValueError(f"Unknown visualization mode: {mode}, expected one of {VIS_MODES}")
+        self.mode = mode
+        self.every_n = max(1, every_n)
+        # A width this far (relative) from the median of the recent widths counts as an outlier
+        self.outlier_tolerance = outlier_tolerance
+        self.recent_widths = deque(maxlen=history)
+
+    def wants_frame(self, frame_index):
+        # Decided before processing, so no drawing work is done for frames that are not saved
+        if self.mode in (VIS_ALL, VIS_VIDEO):
+            return True
+        if self.mode == VIS_EVERY_N:
+            return frame_index % self.every_n == 0
+        return False
+
+    def may_draw(self, frame_index):
+        # Whether the frame can end up saved, the failures mode only decides once the frame is measured
+        return self.mode == VIS_FAILURES or self.wants_frame(frame_index)
+
+    def wants_result(self, road_width):
+        # Decided after processing, in failures mode only frames without boundaries or with outlier widths are saved
+        if self.mode != VIS_FAILURES:
+            return False
+        if road_width is None:
+            return True
+
+        is_outlier = False
+        if len(self.recent_widths) >= 5:
+            median = float(np.median(self.recent_widths))
+            is_outlier = median > 0 and abs(road_width - median) / median > self.outlier_tolerance
+        self.recent_widths.append(road_width)
+        return is_outlier
+
+
+class VisualizationWriter:
+    def __init__(self, output_folder, mode=VIS_ALL, queue_size=16, video_name="processed.mp4", fps=10):
+        self.output_folder = output_folder
+        self.mode = mode
+        self.video_path = os.path.join(output_folder, video_name)
+        self.fps = fps
+        self.video_writer = None
+        self.video_size = None
+
+        # Bounded, so processing waits for the writer instead of piling up frames in memory
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, fname, vis_img):
+        self.queue.put((fname, vis_img))
+
+    def wait(self):
+        # Blocks until every submitted image has been written
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.video_writer is not None:
+            self.video_writer.release()
+            self.video_writer = None
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                fname, vis_img = item
+                self._write(fname, vis_img)
+            except Exception as e:
+                print(f"Could not save the processed image {item[0]}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _write(self, fname, vis_img):
+        if self.mode != VIS_VIDEO:
+            cv2.imwrite(os.path.join(self.output_folder, fname), vis_img)
+            return
+
+        if self.video_writer is None:
+            self.video_size = (vis_img.shape[1], vis_img.shape[0])
+            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+            self.video_writer = cv2.VideoWriter(self.video_path, fourcc, self.fps, self.video_size)
+        if (vis_img.shape[1], vis_img.shape[0]) != self.video_size:
+            vis_img = cv2.resize(vis_img, self.video_size)
+        self.video_writer.write(vis_img)
@@ -0,0 +1,98 @@
+import json
+import os
+import time
+from collections import Counter
+from contextlib import nullcontext
+import numpy as np
+
+# Shared by every untraced stage, so a disabled trace costs one `is None` check per stage
+_NO_STAGE = nullcontext()
+
+
+class _StageTimer:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start
+        self.trace.times[self.name] = self.trace.times.get(self.name, 0.0) + elapsed
+
+
+class FrameTrace:
+    # Wall time per stage and the decisions taken while one frame was measured
+    def __init__(self):
+        self.times = {}
+        self.decisions = {}
+
+    def stage(self, name):
+        return _StageTimer(self, name)
+
+    def note(self, **decisions):
+        self.decisions.update(decisions)
+
+    def note_match(self, best_match):
+        if best_match is None:
+            self.note(car_found=False)
+            return
+        variant = best_match["variant"]
+        self.note(car_found=True, template=variant["template"], scale=variant["scale"], angle=variant["angle"],
+                  match_score=round(float(best_match["score"]), 4))
+
+    def as_dict(self):
+        return {"times_ms": {name: round(t * 1000, 3) for name, t in self.times.items()}, **self.decisions}
+
+
+def stage(trace, name):
+    return trace.stage(name) if trace is not None else _NO_STAGE
+
+
+def trace_log_path(csv_file):
+    # One sidecar per session next to its csv, e.g. measured_data_trace.jsonl
+    return os.path.splitext(csv_file)[0] + "_trace.jsonl"
+
+
+class TraceLog:
+    # Appends one json line per frame and keeps what is needed for the summary at the end
+    def __init__(self, path, resume=True):
+        self.file = open(path, "a" if resume else "w")
+        self.times = {}
+        self.counters = {"branch": Counter(), "failure": Counter(), "car_search": Counter(), "template": Counter()}
+        self.frames = 0
+
+    def record(self, fname, status, trace):
+        entry = {"filename": fname, "status": status, **trace}
+        self.file.write(json.dumps(entry) + "\n")
+        self.frames += 1
+
+        for name, t in trace.get("times_ms", {}).items():
+            self.times.setdefault(name, []).append(t)
+        for key, counter in self.counters.items():
+            if trace.get(key) is not None:
+                counter[trace[key]] += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def summary(self):
+        lines = [f"=== Stage times over {self.frames} frames (ms) ==="]
+        for name, values in self.times.items():
+            p50, p95 = np.percentile(values, [50, 95])
+            lines.append(f"{name:<20} p50 {p50:9.2f}   p95 {p95:9.2f}   max {max(values):9.2f}")
+        for key, counter in self.counters.items():
+            if counter:
+                counts = ", ".join(f"{value}: {count}" for value, count in counter.most_common(5))
+                lines.append(f"{key}: {counts}")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
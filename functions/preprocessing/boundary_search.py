@@ -0,0 +1,66 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class HistogramBoundaries:
+    def __init__(self, hist, threshold, peak_window=50):
+        self.hist = np.asarray(hist)
+        self.threshold = threshold
+        # Width of the area next to a flat region that has to contain a line peak
+        self.peak_window = peak_window
+
+        # Sorted positions where the histogram reaches the threshold
+        self.peaks = np.flatnonzero(self.hist >= threshold)
+        # Running count of positions strictly above the threshold, answers activity checks in O(1)
+        self._above_count = np.concatenate(([0], np.cumsum(self.hist > threshold)))
+        self._zero_runs = None
+
+    def __len__(self):
+        return len(self.hist)
+
+    def nearest_peak_right(self, x):
+        # First position >= x that reaches the threshold
+        i = np.searchsorted(self.peaks, x, side='left')
+        return self.peaks[i] if i < len(self.peaks) else None
+
+    def nearest_peak_left(self, x):
+        # Last position <= x that reaches the threshold
+        if x < 0:
+            return None
+        i = np.searchsorted(self.peaks, x, side='right') - 1
+        return self.peaks[i] if i >= 0 else None
+
+    def has_activity(self, start, stop):
+        # Same as np.any(hist[start:stop] > threshold), including Python's slice semantics
+        start, stop, _ = slice(start, stop).indices(len(self.hist))
+        if stop <= start:
+            return False
+        return bool(self._above_count[stop] - self._above_count[start] > 0)
+
+    def zero_runs(self):
+        # (first, last) positions of every run of exact zeros, found by run-length encoding
+        if self._zero_runs is None:
+            is_zero = np.concatenate(([False], self.hist == 0, [False]))
+            changes = np.flatnonzero(is_zero[1:] != is_zero[:-1])
+            self._zero_runs = (changes[0::2], changes[1::2] - 1)
+        return self._zero_runs
+
+    def valid_flat_groups(self, min_width):
+        # Zero runs of at least min_width whose surroundings on both sides contain a line peak
+        lefts, rights = self.zero_runs()
+        long_enough = rights - lefts + 1 >= min_width
+        lefts, rights = lefts[long_enough], rights[long_enough]
+        if len(lefts) == 0:
+            return []
+
+        window = self.peak_window
+        padding = np.zeros(window + 1, dtype=self.hist.dtype)
+
+        # Window i of before covers hist[i - window:i], window i of after covers hist[i + 1:i + 1 + window]
+        before = sliding_window_view(np.concatenate((padding[:window], self.hist)), window)
+        after = sliding_window_view(np.concatenate((self.hist, padding))[1:], window)
+        left_peaks = before[lefts].max(axis=1)
+        right_peaks = after[rights].max(axis=1)
+
+        valid = (left_peaks >= self.threshold) & (right_peaks >= self.threshold)
+        return list(zip(lefts[valid], rights[valid]))
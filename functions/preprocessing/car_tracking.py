@@ -0,0 +1,119 @@
+import cv2
+import numpy as np
+from .preprocessing import enhance_for_matching, locate_car, car_mask_from_match
+
+
+class CarTracker:
+    def __init__(self, margin=80, min_score=0.6, scene_cut_threshold=30.0, max_frame_gap_ms=1000,
+                 refresh_interval=50, alpha=0.9, orb_weight=0.2, pyramid_levels=0, pyramid_top_k=8,
+                 orb_top_k=None):
+        # Pixels added on every side of the previous bounding box to form the search window
+        self.margin = margin
+        # Windowed matches scoring below this are re-run over the full frame
+        self.min_score = min_score
+        # Mean absolute difference of two consecutive thumbnails (0-255) that counts as a scene cut
+        self.scene_cut_threshold = scene_cut_threshold
+        self.max_frame_gap_ms = max_frame_gap_ms
+        # Force a full-frame search after this many windowed frames so the track can not drift
+        self.refresh_interval = refresh_interval
+        self.alpha = alpha
+        self.orb_weight = orb_weight
+        self.pyramid_levels = pyramid_levels
+        self.pyramid_top_k = pyramid_top_k
+        self.orb_top_k = orb_top_k
+
+        self.previous_bbox = None
+        self.previous_thumbnail = None
+        self.previous_timestamp = None
+        self.frame_timestamp = None
+        self.frames_since_full_search = 0
+
+        # A frame whose window search falls back is counted in both searches, but only once in frames
+        self.frames = 0
+        self.full_searches = 0
+        self.window_searches = 0
+        self.fallbacks = 0
+
+    def start_frame(self, timestamp):
+        # Timestamp (ms) of the next frame handed to locate, used to detect gaps in the session
+        self.frame_timestamp = timestamp
+
+    def reset(self):
+        self.previous_bbox = None
+        self.previous_thumbnail = None
+        self.previous_timestamp = None
+        self.frames_since_full_search = 0
+
+    def locate(self, gray, template_bank, trace=None):
+        self.frames += 1
+        gray_img = enhance_for_matching(gray)
+        thumbnail = cv2.resize(gray_img, (64, 36), interpolation=cv2.INTER_AREA)
+
+        best_match = None
+        search_window = None
+        search = "full"
+        if self.previous_bbox is not None and not self._is_scene_cut(thumbnail) \
+                and self.frames_since_full_search < self.refresh_interval:
+            search_window = self._search_window(gray_img.shape)
+
+        if search_window is not None:
+            self.window_searches += 1
+            best_match = locate_car(gray_img, template_bank, self.alpha, self.orb_weight, search_window,
+                                    self.pyramid_levels, self.pyramid_top_k, self.orb_top_k)
+            search = "window"
+            if best_match is None or best_match["score"] < self.min_score:
+                self.fallbacks += 1
+                best_match = None
+                search = "window_fallback"
+
+        if best_match is None:
+            self.full_searches += 1
+            best_match = locate_car(gray_img, template_bank, self.alpha, self.orb_weight,
+                                    pyramid_levels=self.pyramid_levels, pyramid_top_k=self.pyramid_top_k,
+                                    orb_top_k=self.orb_top_k)
+            self.frames_since_full_search = 0
+        else:
+            self.frames_since_full_search += 1
+
+        self.previous_bbox = best_match["bbox"] if best_match is not None else None
+        self.previous_thumbnail = thumbnail
+        self.previous_timestamp = self.frame_timestamp
+
+        if trace is not None:
+            trace.note(car_search=search)
+            trace.note_match(best_match)
+
+        return car_mask_from_match(gray_img.shape, best_match)
+
+    def counts(self):
+        return self.frames, self.window_searches, self.full_searches, self.fallbacks
+
+    def add_counts(self, counts):
+        # Used to combine the statistics of trackers that ran in other processes
+        frames, window_searches, full_searches, fallbacks = counts
+        self.frames += frames
+        self.window_searches += window_searches
+        self.full_searches += full_searches
+        self.fallbacks += fallbacks
+
+    def summary(self):
+        window_hits = self.window_searches - self.fallbacks
+        return (f"Car tracking: window hits {window_hits} of {self.frames} frames, "
+                f"{self.fallbacks} fallbacks to a full-frame search")
+
+    def _is_scene_cut(self, thumbnail):
+        if self.previous_thumbnail is None:
+            return True
+
+        if self.frame_timestamp is not None and self.previous_timestamp is not None:
+            if abs(self.frame_timestamp - self.previous_timestamp) > self.max_frame_gap_ms:
+                return True
+
+        difference = np.mean(cv2.absdiff(thumbnail, self.previous_thumbnail))
+        return difference > self.scene_cut_threshold
+
+    def _search_window(self, shape):
+        height, width = shape[:2]
+        x1, y1, x2, y2 = self.previous_bbox
+        return (max(0, x1 - self.margin), max(0, y1 - self.margin),
+                min(width, x2 + self.margin), min(height, y2 + self.margin))
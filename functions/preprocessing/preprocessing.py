@@ -1,37 +1,80 @@
-import os
 import cv2
 import numpy as np
 from scipy.ndimage import gaussian_filter1d
-
-
-def pipeline(img, template_folder, threshold=170):
-    img = np.copy(img)
+from .boundary_search import HistogramBoundaries
+from .template_bank import load_template_bank, CLAHE_CLIP_LIMIT, CLAHE_TILE_GRID, ORB_FEATURES
+from ..instrumentation.instrumentation import stage
+
+# Gray level above which a pixel can be a boundary line
+ROAD_THRESHOLD = 170
+# HSV ranges of grass and gravel/sand, removed from the road mask
+GREEN_HSV_RANGE = ((35, 40, 40), (90, 255, 255))
+YELLOW_HSV_RANGE = ((15, 40, 40), (35, 255, 255))
+# Half height of the scanline band the histogram is summed over
+BAND_HALF_HEIGHT = 5
+
+
+def pipeline(img, template_folder, threshold=ROAD_THRESHOLD, template_bank=None, car_tracker=None, pyramid_levels=0,
+             pyramid_top_k=8, roi_only=False, band_half_height=BAND_HALF_HEIGHT, bgr=False, trace=None):
+    # img is RGB, or BGR as decoded by cv2.imread when bgr is set. It is only read, never modified.
+    # The grayscale image is shared by template matching and the threshold
+    with stage(trace, "gray"):
+        gray = to_gray(img, bgr)
 
     # Car mask, bounding box, center
     car_mask, car_bbox, car_center = None, None, None
-    if template_folder:
-        car_mask, car_bbox, car_center = template_matching(img, template_folder)
+    with stage(trace, "template_matching"):
+        if car_tracker is not None:
+            if template_bank is None:
+                template_bank = load_template_bank(template_folder)
+            car_mask, car_bbox, car_center = car_tracker.locate(gray, template_bank, trace)
+        elif template_folder or template_bank is not None:
+            car_mask, car_bbox, car_center = template_matching(img, template_folder, template_bank=template_bank,
+                                                               pyramid_levels=pyramid_levels,
+                                                               pyramid_top_k=pyramid_top_k, gray=gray, trace=trace)
+
+    with stage(trace, "binary"):
+        # Only the scanline band and the car region are read further on
+        if roi_only and car_bbox is not None:
+            return roi_binary(img, gray, car_bbox, threshold, band_half_height, bgr), car_bbox, car_center
+
+        combined_binary = road_binary(img, gray, threshold, bgr)
+
+        # Apply car mask
+        if car_mask is not None:
+            combined_binary = combined_binary * car_mask
+
+        # Light denoising
+        kernel = np.ones((3, 3), np.uint8)
+        combined_binary = cv2.morphologyEx(combined_binary, cv2.MORPH_OPEN, kernel)
+
+    return combined_binary, car_bbox, car_center
+
 
-    # Convert to HSV for color filtering
-    hsv = cv2.cvtColor(img, cv2.COLOR_RGB2HSV)
+def to_gray(img, bgr=False):
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY if bgr else cv2.COLOR_RGB2GRAY)
+
+
+def road_binary(img, gray, threshold, bgr=False, hsv=None, green_range=GREEN_HSV_RANGE,
+                yellow_range=YELLOW_HSV_RANGE):
+    # Convert to HSV for color filtering (hsv can be passed in when the caller already converted the image)
+    if hsv is None:
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV if bgr else cv2.COLOR_RGB2HSV)
 
     # Green mask (grass)
-    lower_green = np.array([35, 40, 40])
-    upper_green = np.array([90, 255, 255])
+    lower_green = np.array(green_range[0])
+    upper_green = np.array(green_range[1])
     green_mask = cv2.inRange(hsv, lower_green, upper_green)
 
     # Yellow/brown mask (gravel/sand)
-    lower_yellow = np.array([15, 40, 40])
-    upper_yellow = np.array([35, 255, 255])
+    lower_yellow = np.array(yellow_range[0])
+    upper_yellow = np.array(yellow_range[1])
     yellow_mask = cv2.inRange(hsv, lower_yellow, upper_yellow)
 
     # Exclude those regions
     exclude_mask = cv2.bitwise_or(green_mask, yellow_mask)
     road_mask = cv2.bitwise_not(exclude_mask)
 
-    # Convert to grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-
     # Apply simple threshold
     _, binary_all = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY)
 
@@ -39,96 +82,239 @@ def pipeline(img, template_folder, threshold=170):
     binary = cv2.bitwise_and(binary_all, binary_all, mask=road_mask)
 
     # Convert to binary (0 and 1 for further use)
-    combined_binary = (binary // 255).astype(np.uint8)
+    return (binary // 255).astype(np.uint8)
 
-    # Apply car mask
-    if car_mask is not None:
-        combined_binary = combined_binary * car_mask
 
-    # Light denoising
+def roi_regions(shape, car_bbox, band_half_height=BAND_HALF_HEIGHT):
+    height, width = shape[:2]
+    x1, y1, x2, y2 = car_bbox
+
+    # Rows summed by get_hist
+    center_y = (max(0, y1) + min(height, y2)) // 2
+    band = (max(0, center_y - band_half_height), min(height, center_y + band_half_height), 0, width)
+
+    # Car box plus the one pixel ring checked by mark_line_intersections
+    car = (max(0, y1 - 1), min(height, y2 + 1), max(0, x1 - 1), min(width, x2 + 1))
+
+    return [band, car]
+
+
+def roi_binary(img, gray, car_bbox, threshold, band_half_height=BAND_HALF_HEIGHT, bgr=False, hsv=None,
+               green_range=GREEN_HSV_RANGE, yellow_range=YELLOW_HSV_RANGE):
+    # Same values as the full-frame binary inside the regions of interest and zero elsewhere. The 3x3 opening
+    # (erosion then dilation) reads two pixels around every output pixel, so each region is processed with that
+    # much padding. np.zeros leaves the untouched part of the frame to the lazily zeroed pages of the allocator.
+    # A full-frame hsv image can be passed in to share it between several calls on the same frame.
+    height, width = img.shape[:2]
+    x1, y1, x2, y2 = car_bbox
+    pad = 2
     kernel = np.ones((3, 3), np.uint8)
-    combined_binary = cv2.morphologyEx(combined_binary, cv2.MORPH_OPEN, kernel)
 
-    return combined_binary, car_bbox, car_center
+    combined_binary = np.zeros((height, width), dtype=np.uint8)
+    for ry1, ry2, rx1, rx2 in roi_regions(img.shape, car_bbox, band_half_height):
+        if ry2 <= ry1 or rx2 <= rx1:
+            continue
+        py1, py2 = max(0, ry1 - pad), min(height, ry2 + pad)
+        px1, px2 = max(0, rx1 - pad), min(width, rx2 + pad)
 
+        region_hsv = hsv[py1:py2, px1:px2] if hsv is not None else None
+        region = road_binary(img[py1:py2, px1:px2], gray[py1:py2, px1:px2], threshold, bgr, region_hsv,
+                             green_range, yellow_range)
 
-def template_matching(img, template_folder, alpha=0.9, orb_weight=0.2):
-    # Apply CLAHE to input image
-    gray_img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-    clahe = cv2.createCLAHE(2.0, (8, 8))
-    gray_img = clahe.apply(gray_img)
+        # Apply car mask
+        region[max(0, y1 - py1):max(0, y2 - py1), max(0, x1 - px1):max(0, x2 - px1)] = 0
+
+        # Light denoising
+        region = cv2.morphologyEx(region, cv2.MORPH_OPEN, kernel)
+        combined_binary[ry1:ry2, rx1:rx2] = region[ry1 - py1:ry2 - py1, rx1 - px1:rx2 - px1]
+
+    return combined_binary
+
+
+def template_matching(img, template_folder, alpha=0.9, orb_weight=0.2, template_bank=None, pyramid_levels=0,
+                      pyramid_top_k=8, orb_top_k=None, gray=None, trace=None):
+    if template_bank is None:
+        template_bank = load_template_bank(template_folder)
+
+    # gray can be passed in when the caller already converted the RGB image
+    if gray is None:
+        gray = to_gray(img)
+    gray_img = enhance_for_matching(gray)
+    best_match = locate_car(gray_img, template_bank, alpha, orb_weight, pyramid_levels=pyramid_levels,
+                            pyramid_top_k=pyramid_top_k, orb_top_k=orb_top_k)
+    if trace is not None:
+        trace.note(car_search="full")
+        trace.note_match(best_match)
+
+    return car_mask_from_match(gray_img.shape, best_match)
+
+
+def enhance_for_matching(gray):
+    # Apply CLAHE to the grayscale input image
+    clahe = cv2.createCLAHE(CLAHE_CLIP_LIMIT, CLAHE_TILE_GRID)
+    return clahe.apply(gray)
+
+
+def locate_car(gray_img, template_bank, alpha=0.9, orb_weight=0.2, search_window=None, pyramid_levels=0,
+               pyramid_top_k=8, orb_top_k=None):
+    # Only the window (x1, y1, x2, y2) of the CLAHE image is searched, positions are returned in frame coordinates
+    x_offset, y_offset = 0, 0
+    if search_window is not None:
+        x_offset, y_offset, window_x2, window_y2 = search_window
+        gray_img = gray_img[y_offset:window_y2, x_offset:window_x2]
     edge_img = cv2.Canny(gray_img, 50, 150)
 
-    best_score = -1
-    best_bbox = None
-    best_center = None
-    car_mask = np.ones_like(gray_img, dtype=np.uint8)
+    candidates = []
+    if pyramid_levels > 0:
+        candidates = pyramid_candidates(gray_img, edge_img, template_bank, alpha, pyramid_levels, pyramid_top_k)
+    if not candidates:
+        candidates = exhaustive_candidates(gray_img, edge_img, template_bank)
+
+    best_match = best_candidate(gray_img, candidates, alpha, orb_weight, orb_top_k)
+    if best_match is not None:
+        x1, y1, x2, y2 = best_match["bbox"]
+        cx, cy = best_match["center"]
+        best_match["bbox"] = (x1 + x_offset, y1 + y_offset, x2 + x_offset, y2 + y_offset)
+        best_match["center"] = (cx + x_offset, cy + y_offset)
+
+    return best_match
 
-    orb = cv2.ORB_create(nfeatures=500)
 
-    for filename in os.listdir(template_folder):
-        if not filename.lower().endswith(".png"):
+def exhaustive_candidates(gray_img, edge_img, template_bank):
+    candidates = []
+    for variant in template_bank.variants:
+        r_gray = variant["gray"]
+        r_edge = variant["edge"]
+
+        h, w = r_gray.shape
+        if h > gray_img.shape[0] or w > gray_img.shape[1]:
             continue
-        template_path = os.path.join(template_folder, filename)
-        template_color = cv2.imread(template_path)
-        if template_color is None:
+
+        # Template matching scores
+        result_color = cv2.matchTemplate(gray_img, r_gray, cv2.TM_CCOEFF_NORMED)
+        _, color_score, _, color_loc = cv2.minMaxLoc(result_color)
+
+        result_edge = cv2.matchTemplate(edge_img, r_edge, cv2.TM_CCOEFF_NORMED)
+        _, edge_score, _, edge_loc = cv2.minMaxLoc(result_edge)
+
+        candidates.append({"variant": variant, "color_score": color_score, "edge_score": edge_score,
+                           "loc": color_loc})
+
+    return candidates
+
+
+def pyramid_candidates(gray_img, edge_img, template_bank, alpha, levels, top_k):
+    # Score every variant on a 1 / 2**levels image and refine only the top_k locations at full resolution
+    factor = 2 ** levels
+    small_size = (gray_img.shape[1] // factor, gray_img.shape[0] // factor)
+    if min(small_size) < 1:
+        return []
+    small_gray = cv2.resize(gray_img, small_size, interpolation=cv2.INTER_AREA)
+    small_edge = cv2.resize(edge_img, small_size, interpolation=cv2.INTER_AREA)
+
+    coarse = []
+    for variant, (s_gray, s_edge) in zip(template_bank.variants, template_bank.pyramid(levels)):
+        h, w = s_gray.shape
+        if min(h, w) < 4 or h > small_gray.shape[0] or w > small_gray.shape[1]:
             continue
 
-        template_gray = cv2.cvtColor(template_color, cv2.COLOR_BGR2GRAY)
-        template_gray = clahe.apply(template_gray)
-        template_edge = cv2.Canny(template_gray, 50, 150)
-
-        for scale in [0.9, 1.0, 1.1]:
-            t_gray = cv2.resize(template_gray, None, fx=scale, fy=scale)
-            t_edge = cv2.resize(template_edge, None, fx=scale, fy=scale)
-
-            for angle in [-15, 0, 15]:
-                center = (t_gray.shape[1] // 2, t_gray.shape[0] // 2)
-                M = cv2.getRotationMatrix2D(center, angle, 1.0)
-                r_gray = cv2.warpAffine(t_gray, M, (t_gray.shape[1], t_gray.shape[0]))
-                r_edge = cv2.warpAffine(t_edge, M, (t_edge.shape[1], t_edge.shape[0]))
-
-                # Template matching scores
-                result_color = cv2.matchTemplate(gray_img, r_gray, cv2.TM_CCOEFF_NORMED)
-                _, color_score, _, color_loc = cv2.minMaxLoc(result_color)
-
-                result_edge = cv2.matchTemplate(edge_img, r_edge, cv2.TM_CCOEFF_NORMED)
-                _, edge_score, _, edge_loc = cv2.minMaxLoc(result_edge)
-
-                h, w = r_gray.shape
-                x1, y1 = color_loc
-                x2, y2 = x1 + w, y1 + h
-                patch = gray_img[y1:y2, x1:x2]
-
-                orb_score = 0
-
-                if patch.shape == r_gray.shape:
-                    kp1, des1 = orb.detectAndCompute(r_gray, None)
-                    kp2, des2 = orb.detectAndCompute(patch, None)
-                    if des1 is not None and des2 is not None:
-                        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-                        matches = bf.match(des1, des2)
-                        match_count = len(matches)
-                        orb_score = min(1.0, np.log1p(match_count) / np.log1p(150))
-
-                # Final score combining all components
-                combined_score = (
-                        alpha * color_score +
-                        (1 - alpha) * edge_score +
-                        orb_weight * orb_score
-                )
-
-                if combined_score > best_score:
-                    best_score = combined_score
-                    best_bbox = (x1, y1, x2, y2)
-                    best_center = (x1 + w // 2, y1 + h * 5 // 8)
-                    car_mask = np.ones_like(gray_img, dtype=np.uint8)
-                    car_mask[y1:y2, x1:x2] = 0
-
-    return car_mask, best_bbox, best_center
-
-
-def get_hist(img, y_range, band_half_height=5):
+        result_color = cv2.matchTemplate(small_gray, s_gray, cv2.TM_CCOEFF_NORMED)
+        result_edge = cv2.matchTemplate(small_edge, s_edge, cv2.TM_CCOEFF_NORMED)
+        result = alpha * result_color + (1 - alpha) * result_edge
+        _, score, _, loc = cv2.minMaxLoc(result)
+        coarse.append((score, loc, variant))
+
+    coarse.sort(key=lambda c: c[0], reverse=True)
+
+    candidates = []
+    radius = factor + 2
+    for _, (sx, sy), variant in coarse[:top_k]:
+        r_gray = variant["gray"]
+        r_edge = variant["edge"]
+        h, w = r_gray.shape
+
+        # Full-resolution window that covers the rounding error of the coarse location
+        wx1 = max(0, sx * factor - radius)
+        wy1 = max(0, sy * factor - radius)
+        wx2 = min(gray_img.shape[1], sx * factor + w + radius)
+        wy2 = min(gray_img.shape[0], sy * factor + h + radius)
+        if wx2 - wx1 < w or wy2 - wy1 < h:
+            continue
+
+        result_color = cv2.matchTemplate(gray_img[wy1:wy2, wx1:wx2], r_gray, cv2.TM_CCOEFF_NORMED)
+        _, color_score, _, (lx, ly) = cv2.minMaxLoc(result_color)
+
+        result_edge = cv2.matchTemplate(edge_img[wy1:wy2, wx1:wx2], r_edge, cv2.TM_CCOEFF_NORMED)
+        _, edge_score, _, _ = cv2.minMaxLoc(result_edge)
+
+        candidates.append({"variant": variant, "color_score": color_score, "edge_score": edge_score,
+                           "loc": (wx1 + lx, wy1 + ly)})
+
+    return candidates
+
+
+def best_candidate(gray_img, candidates, alpha, orb_weight, orb_top_k=None):
+    # The ORB score is at most 1, so a candidate whose color/edge score plus the full ORB bonus
+    # can not beat the best combined score so far is never verified
+    for candidate in candidates:
+        candidate["base_score"] = alpha * candidate["color_score"] + (1 - alpha) * candidate["edge_score"]
+    candidates = sorted(candidates, key=lambda c: c["base_score"], reverse=True)
+    if orb_top_k is not None:
+        candidates = candidates[:orb_top_k]
+
+    best_score = -1
+    best_match = None
+
+    orb = cv2.ORB_create(nfeatures=ORB_FEATURES)
+    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+
+    for candidate in candidates:
+        if candidate["base_score"] + max(orb_weight, 0) <= best_score:
+            break
+
+        variant = candidate["variant"]
+        r_gray = variant["gray"]
+        h, w = r_gray.shape
+        x1, y1 = candidate["loc"]
+        x2, y2 = x1 + w, y1 + h
+        patch = gray_img[y1:y2, x1:x2]
+
+        orb_score = 0
+
+        des1 = variant["descriptors"]
+        if orb_weight and des1 is not None and patch.shape == r_gray.shape:
+            _, des2 = orb.detectAndCompute(patch, None)
+            if des2 is not None:
+                matches = bf.match(des1, des2)
+                match_count = len(matches)
+                orb_score = min(1.0, np.log1p(match_count) / np.log1p(150))
+
+        # Final score combining all components
+        combined_score = candidate["base_score"] + orb_weight * orb_score
+
+        if combined_score > best_score:
+            best_score = combined_score
+            best_match = {
+                "score": combined_score,
+                "bbox": (x1, y1, x2, y2),
+                "center": (x1 + w // 2, y1 + h * 5 // 8),
+                "variant": variant,
+            }
+
+    return best_match
+
+
+def car_mask_from_match(shape, best_match):
+    car_mask = np.ones(shape, dtype=np.uint8)
+    if best_match is None:
+        return car_mask, None, None
+
+    x1, y1, x2, y2 = best_match["bbox"]
+    car_mask[y1:y2, x1:x2] = 0
+    return car_mask, best_match["bbox"], best_match["center"]
+
+
+def get_hist(img, y_range, band_half_height=BAND_HALF_HEIGHT):
     y1, y2 = y_range
     center_y = (y1 + y2) // 2
     band_y1 = max(0, center_y - band_half_height)
@@ -140,59 +326,40 @@ def get_hist(img, y_range, band_half_height=5):
     return smoothed
 
 
-def mark_edges_of_flat_region(binary_img, car_bbox, hist, threshold, y_range, min_road_width):
-    vis_img = cv2.cvtColor((binary_img * 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+def mark_edges_of_flat_region(binary_img, car_bbox, hist, threshold, y_range, min_road_width, boundaries=None,
+                              visualize=True):
+    vis_img = None
+    if visualize:
+        vis_img = cv2.cvtColor((binary_img * 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
     h, w = binary_img.shape
     center_x = w // 2
     y_center = (y_range[0] + y_range[1]) // 2
     x1, y1, x2, y2 = car_bbox
 
-    def find_valid_flat_groups(hist, min_road_width, threshold):
-        # Find indices where the histogram is exactly zero
-        zero_indices = np.where(hist == 0)[0]
-        if len(zero_indices) == 0:
-            return []
-
-        # Group continuous flat regions
-        groups = np.split(zero_indices, np.where(np.diff(zero_indices) > 1)[0] + 1)
-
-        valid_groups = []
-        for group in groups:
-            if len(group) < min_road_width:
-                continue
-
-            left = group[0]
-            right = group[-1]
-
-            # Check for peaks near the edges of the flat region
-            left_peak = np.max(hist[max(0, left - 50):left]) if left > 0 else 0
-            right_peak = np.max(hist[right + 1:min(len(hist), right + 51)]) if right < len(hist) - 1 else 0
-
-            if left_peak >= threshold and right_peak >= threshold:
-                valid_groups.append(group)
-
-        return valid_groups
+    if boundaries is None:
+        boundaries = HistogramBoundaries(hist, threshold)
 
-    flat_groups = find_valid_flat_groups(hist, min_road_width, threshold)
-    cv2.rectangle(vis_img, (x1, y1), (x2, y2), (255, 0, 0), 2)
+    flat_groups = boundaries.valid_flat_groups(min_road_width)
+    if vis_img is not None:
+        cv2.rectangle(vis_img, (x1, y1), (x2, y2), (255, 0, 0), 2)
 
     # Try to select group that includes center
     central_group = None
-    for group in flat_groups:
-        if group[0] <= center_x <= group[-1]:
-            central_group = group
+    for left, right in flat_groups:
+        if left <= center_x <= right:
+            central_group = (left, right)
             break
 
     if central_group is None and flat_groups:
         central_group = flat_groups[0]  # Fallback: first valid group found
 
     if central_group is not None:
-        left_idx = central_group[0]
-        right_idx = central_group[-1]
+        left_idx, right_idx = central_group
 
         # Draw on image
-        cv2.circle(vis_img, (left_idx, y_center), 6, (0, 0, 255), -1)  # Red
-        cv2.circle(vis_img, (right_idx, y_center), 6, (0, 0, 255), -1)  # Red
+        if vis_img is not None:
+            cv2.circle(vis_img, (left_idx, y_center), 6, (0, 0, 255), -1)  # Red
+            cv2.circle(vis_img, (right_idx, y_center), 6, (0, 0, 255), -1)  # Red
 
         return (left_idx, y_center), (right_idx, y_center), vis_img
 
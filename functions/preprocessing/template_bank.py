@@ -0,0 +1,123 @@
+import hashlib
+import os
+import pickle
+import cv2
+
+TEMPLATE_SCALES = (0.9, 1.0, 1.1)
+TEMPLATE_ANGLES = (-15, 0, 15)
+CLAHE_CLIP_LIMIT = 2.0
+CLAHE_TILE_GRID = (8, 8)
+ORB_FEATURES = 500
+
+# Banks already built in this process, keyed by their content hash
+_loaded_banks = {}
+
+
+class TemplateBank:
+    def __init__(self, key, variants):
+        # Content hash of the template files and the variant parameters
+        self.key = key
+        # One dict per template/scale/angle combination
+        self.variants = variants
+        self._pyramids = {}
+
+    def __len__(self):
+        return len(self.variants)
+
+    def pyramid(self, levels):
+        # Gray and edge variants downsampled by 2**levels, built on first use
+        if levels not in self._pyramids:
+            factor = 2 ** levels
+            downsampled = []
+            for variant in self.variants:
+                h, w = variant["gray"].shape
+                size = (max(1, w // factor), max(1, h // factor))
+                downsampled.append((cv2.resize(variant["gray"], size, interpolation=cv2.INTER_AREA),
+                                    cv2.resize(variant["edge"], size, interpolation=cv2.INTER_AREA)))
+            self._pyramids[levels] = downsampled
+        return self._pyramids[levels]
+
+
+def list_template_files(template_folder):
+    return sorted(f for f in os.listdir(template_folder) if f.lower().endswith(".png"))
+
+
+def template_bank_key(template_folder, scales=TEMPLATE_SCALES, angles=TEMPLATE_ANGLES):
+    sha = hashlib.sha1()
+    for filename in list_template_files(template_folder):
+        sha.update(filename.encode("utf-8"))
+        with open(os.path.join(template_folder, filename), "rb") as f:
+            sha.update(f.read())
+
+    # Changing any of the preprocessing parameters invalidates the cached bank
+    params = (tuple(scales), tuple(angles), CLAHE_CLIP_LIMIT, CLAHE_TILE_GRID, ORB_FEATURES)
+    sha.update(repr(params).encode("utf-8"))
+    return sha.hexdigest()
+
+
+def build_template_bank(template_folder, scales=TEMPLATE_SCALES, angles=TEMPLATE_ANGLES):
+    clahe = cv2.createCLAHE(CLAHE_CLIP_LIMIT, CLAHE_TILE_GRID)
+    orb = cv2.ORB_create(nfeatures=ORB_FEATURES)
+
+    variants = []
+    for filename in list_template_files(template_folder):
+        template_color = cv2.imread(os.path.join(template_folder, filename))
+        if template_color is None:
+            continue
+
+        template_gray = cv2.cvtColor(template_color, cv2.COLOR_BGR2GRAY)
+        template_gray = clahe.apply(template_gray)
+        template_edge = cv2.Canny(template_gray, 50, 150)
+
+        for scale in scales:
+            t_gray = cv2.resize(template_gray, None, fx=scale, fy=scale)
+            t_edge = cv2.resize(template_edge, None, fx=scale, fy=scale)
+
+            for angle in angles:
+                center = (t_gray.shape[1] // 2, t_gray.shape[0] // 2)
+                M = cv2.getRotationMatrix2D(center, angle, 1.0)
+                r_gray = cv2.warpAffine(t_gray, M, (t_gray.shape[1], t_gray.shape[0]))
+                r_edge = cv2.warpAffine(t_edge, M, (t_edge.shape[1], t_edge.shape[0]))
+
+                # Template side of the ORB verification never changes between frames
+                _, descriptors = orb.detectAndCompute(r_gray, None)
+
+                variants.append({
+                    "template": filename,
+                    "scale": scale,
+                    "angle": angle,
+                    "gray": r_gray,
+                    "edge": r_edge,
+                    "descriptors": descriptors,
+                })
+
+    return TemplateBank(template_bank_key(template_folder, scales, angles), variants)
+
+
+def load_template_bank(template_folder, cache_folder=None, scales=TEMPLATE_SCALES, angles=TEMPLATE_ANGLES):
+    key = template_bank_key(template_folder, scales, angles)
+    if key in _loaded_banks:
+        return _loaded_banks[key]
+
+    cache_path = os.path.join(cache_folder, key + ".pkl") if cache_folder else None
+
+    bank = None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                bank = TemplateBank(key, pickle.load(f))
+        except Exception as e:
+            print(f"Could not read the template bank cache {cache_path}: {e}")
+
+    if bank is None:
+        bank = build_template_bank(template_folder, scales, angles)
+        if cache_path:
+            os.makedirs(cache_folder, exist_ok=True)
+            # Write to a temporary file first so parallel runs never read a partial cache
+            tmp_path = cache_path + f".{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(bank.variants, f)
+            os.replace(tmp_path, cache_path)
+
+    _loaded_banks[key] = bank
+    return bank
@@ -0,0 +1,68 @@
+import os
+
+FRAME_MEASURED = "measured"
+FRAME_NO_BOUNDARIES = "no_boundaries"
+FRAME_FAILED = "failed"
+# Frames with these statuses are not processed again when a session is resumed
+FINISHED_STATUSES = (FRAME_MEASURED, FRAME_NO_BOUNDARIES)
+SESSION_COMPLETE = "#session_complete"
+
+
+def frame_journal_path(csv_file):
+    # The journal lives next to the csv it describes, e.g. measured_data_journal.log
+    return os.path.splitext(csv_file)[0] + "_journal.log"
+
+
+def load_frame_journal(journal_path):
+    statuses = {}
+    complete = False
+    if not os.path.exists(journal_path):
+        return statuses, complete
+
+    with open(journal_path, "r") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line == SESSION_COMPLETE:
+                complete = True
+                continue
+
+            # A line cut short by a crash has no status and is ignored
+            parts = line.split("\t")
+            if len(parts) == 2 and parts[1]:
+                statuses[parts[0]] = parts[1]
+
+    return statuses, complete
+
+
+class FrameJournal:
+    def __init__(self, journal_path, resume=True):
+        if resume and os.path.exists(journal_path) and os.path.getsize(journal_path) > 0:
+            # Terminate a line that was cut short by a crash before appending to it
+            with open(journal_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+            self.file = open(journal_path, "a")
+            if needs_newline:
+                self.file.write("\n")
+        else:
+            self.file = open(journal_path, "w")
+
+    def record(self, fname, status):
+        self.file.write(f"{fname}\t{status}\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def mark_complete(self):
+        self.file.write(SESSION_COMPLETE + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -10,5 +10,10 @@ def load_processed_timestamps(processed_log):
 
 
 def save_processed_timestamps(processed_log, timestamps):
-    with open(processed_log, "w") as f:
-        json.dump(list(timestamps), f)
+    # Write to a temporary file and swap it in, so an interrupted save never leaves a broken log
+    tmp_log = processed_log + ".tmp"
+    with open(tmp_log, "w") as f:
+        json.dump(sorted(timestamps), f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_log, processed_log)
@@ -1,20 +1,21 @@
 import ac
 import os
-import csv
 import time
 from dataGathering import car_data
-from config import DATA, CSV
+from dataGathering.frame_channel import FrameTimestampSubscriber
+from dataGathering.telemetry_log import BufferedCsvWriter
+from config import DATA, CSV, FRAME_CHANNEL_PORT, TIMESTAMP_FILE
 
 # === State ===
 csv_created = False
-csv_file = None
-csv_writer = None
-last_logged_ts = None
+frame_log = None
+telemetry_log = None
+frame_channel = None
 APP_NAME = 'image_capture'
 
 
 def acMain(ac_version):
-    global csv_created, csv_file, csv_writer
+    global csv_created, frame_log, telemetry_log, frame_channel
 
     # Create timestamped CSV
     session_file = os.path.join(os.path.dirname(__file__), "session_name.txt")
@@ -27,52 +28,46 @@ def acMain(ac_version):
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
 
+    # One row per screenshot, with the car state of the game update that received its timestamp
     filepath = os.path.join(data_dir, session_name + ".csv")
-    csv_file = open(filepath, 'w', newline='')
-    csv_writer = csv.writer(csv_file)
-    csv_writer.writerow(['timestamp', 'lap_position', 'pos_x', 'pos_y', 'filename'])
+    frame_log = BufferedCsvWriter(filepath, ['timestamp', 'lap_position', 'pos_x', 'pos_y', 'filename'])
+
+    # The car state of every game update, the frames are later interpolated between these samples
+    telemetry_path = os.path.join(data_dir, session_name + "_telemetry.csv")
+    telemetry_log = BufferedCsvWriter(telemetry_path, ['timestamp', 'lap_position', 'pos_x', 'pos_y'])
+
+    # Frame timestamps arrive over a localhost socket, the timestamp file is only read without one
+    frame_channel = FrameTimestampSubscriber(FRAME_CHANNEL_PORT, os.path.join(dirname, TIMESTAMP_FILE))
+    if not frame_channel.uses_socket():
+        ac.log("image_capture: socket unavailable, falling back to " + TIMESTAMP_FILE)
 
     csv_created = True
     return APP_NAME
 
 
 def acUpdate(deltaT):
-    global csv_writer, csv_created, last_logged_ts
-
-    # Get car data
-    lap_pos = car_data.get_lap_position()
-    x, y = car_data.get_world_location()
-
     if not csv_created:
         return
 
-    # Path to file written by external screenshot script
-    ts_file = os.path.join(os.path.dirname(__file__), "last_image_timestamp.txt")
+    # Same clock as the capture timestamps (milliseconds since the epoch)
+    now = time.time()
+    ts_now = int(round(now * 1000))
 
-    # If no new screenshot, do nothing
-    if not os.path.exists(ts_file):
-        return
-
-    try:
-        with open(ts_file, 'r') as f:
-            ts_str = f.read().strip()
-            if not ts_str:
-                return
-            ts = int(ts_str)
-    except:
-        return
-
-    if ts == last_logged_ts:
-        return  # Already logged this one
+    # Get car data
+    lap_pos = car_data.get_lap_position()
+    x, y = car_data.get_world_location()
 
-    last_logged_ts = ts
+    # Rows are only buffered here, the files are written in batches
+    telemetry_log.add([ts_now, lap_pos, x, y], now)
 
-    image_filename = "frame_{0}.png".format(ts)
-    csv_writer.writerow([ts, lap_pos, x, y, image_filename])
-    csv_file.flush()
+    for ts in frame_channel.drain():
+        image_filename = "frame_{0}.png".format(ts)
+        frame_log.add([ts, lap_pos, x, y, image_filename], now)
 
 
 def acShutdown():
-    global csv_file
-    if csv_file is not None:
-        csv_file.close()
+    if frame_channel is not None:
+        frame_channel.close()
+    for log in (frame_log, telemetry_log):
+        if log is not None:
+            log.close()
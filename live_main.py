@@ -0,0 +1,22 @@
+import os
+from functions.imageProcessing.live_processing import live_process_folder
+from functions.analyseResults.calibration import load_pixel_ratio
+from config import DATA, PROCESSED_IMAGES, CSV, IMAGES, TEMPLATE_FOLDER, CALIBRATION
+
+if __name__ == '__main__':
+    # Run next to dataGathering/external_capture.py, once the capture has created its image folder.
+    # Measures the frames while they are captured, main.py afterwards only processes what is left
+    latest_folder = sorted(os.listdir(os.path.join(DATA, IMAGES)))[-1]
+    timestamp = latest_folder.replace("images_", "")
+
+    timestamp_csv_folder = os.path.join(DATA, CSV, timestamp)
+    timestamp_processed_images_folder = os.path.join(DATA, PROCESSED_IMAGES, timestamp)
+    os.makedirs(timestamp_csv_folder, exist_ok=True)
+
+    measured_data_csv = os.path.join(timestamp_csv_folder, "measured_data.csv")
+    pixel_ratio = load_pixel_ratio(os.path.join(DATA, CALIBRATION, "pixel_ratios.json"), "ks_nurburgring-layout_gp_a")
+
+    # Stops once no new frames have arrived for idle_timeout seconds. main.py finishes the same session,
+    # so the car is detected with the same settings as there
+    live_process_folder(latest_folder, timestamp_processed_images_folder, TEMPLATE_FOLDER, measured_data_csv,
+                        workers=2, idle_timeout=60, pixel_ratio=pixel_ratio)
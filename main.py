@@ -2,10 +2,17 @@ import os
 import pandas as pd
 from functions.imageProcessing.imageProcessing import batch_process_folder
 from functions.analyseResults import mergeDFs, keepImagesWithCsvData, groundTruthMeasuredDataRelation, \
-    analyse_results
+    analyse_results, calibration, track_segments, session_table
 from functions.processedTimestampsLog.processed_timestamps_log import load_processed_timestamps, \
     save_processed_timestamps
-from config import DATA, PROCESSED_IMAGES, CSV, IMAGES, TRUTH_DATA, PROCESSED_LOG, TEMPLATE_FOLDER
+from config import DATA, PROCESSED_IMAGES, CSV, IMAGES, TRUTH_DATA, PROCESSED_LOG, TEMPLATE_FOLDER, CALIBRATION, \
+    TRACK_SEGMENTS_CACHE
+
+# The results of a session are kept in one typed parquet file (results.parquet, needs pyarrow).
+# With EXPORT_CSV they are also written to results.csv for reading
+EXPORT_CSV = True
+# Pickle the results (results.pkl) when pyarrow is not installed instead of stopping with an error
+PICKLE_FALLBACK = False
 
 if __name__ == '__main__':
     # Takes the latest folder of images
@@ -22,22 +29,29 @@ if __name__ == '__main__':
     timestamp_csv_folder = os.path.join(DATA, CSV, timestamp)
     timestamp_processed_images_folder = os.path.join(DATA, PROCESSED_IMAGES, timestamp)
     processed_timestamps_log_folder = os.path.join(DATA, PROCESSED_LOG)
+    calibration_folder = os.path.join(DATA, CALIBRATION)
+    track_segments_cache_folder = os.path.join(DATA, TRACK_SEGMENTS_CACHE)
     # ---------------- SETUP PATHS --------------------------------
 
     # ---------------- ENSURE PATH EXISTS --------------------------------
     os.makedirs(timestamp_csv_folder, exist_ok=True)
     os.makedirs(timestamp_processed_images_folder, exist_ok=True)
     os.makedirs(processed_timestamps_log_folder, exist_ok=True)
+    os.makedirs(calibration_folder, exist_ok=True)
     # ---------------- ENSURE PATH EXISTS --------------------------------
 
     # ---------------- SETUP CSVs --------------------------------
     processed_timestamps_log = os.path.join(processed_timestamps_log_folder, "processed_timestamps.json")
     measured_data_csv = os.path.join(timestamp_csv_folder, "measured_data.csv")
     game_collected_data_csv = os.path.join(timestamp_csv_folder, timestamp + ".csv")
-    truth_csv = os.path.join(DATA, TRUTH_DATA, "ks_nurburgring-layout_gp_a.csv")
-    merged_datasets_csv = os.path.join(timestamp_csv_folder, "merged_datasets.csv")
+    # Written by the in-game app at every game update (not present for older sessions)
+    telemetry_csv = os.path.join(timestamp_csv_folder, timestamp + "_telemetry.csv")
+    track = "ks_nurburgring-layout_gp_a"
+    truth_csv = os.path.join(DATA, TRUTH_DATA, track + ".csv")
     results_csv = os.path.join(timestamp_csv_folder, "results.csv")
     road_type_grouped_results_csv = os.path.join(timestamp_csv_folder, "road_type_results.csv")
+    calibration_sweep_csv = os.path.join(timestamp_csv_folder, "calibration_sweep.csv")
+    pixel_ratios_json = os.path.join(calibration_folder, "pixel_ratios.json")
     # ---------------- SETUP CSVs --------------------------------
 
     # ---------------- CREATE DFs --------------------------------
@@ -51,16 +65,21 @@ if __name__ == '__main__':
     if timestamp not in processed_timestamps:
         print(f"\nRunning one-time image processing function (batch_process_folder) for {timestamp}\n")
         # Run the image processing, which also saves the measured data to the "measured_data_csv"
-        batch_process_folder(latest_folder, timestamp_processed_images_folder, TEMPLATE_FOLDER,
-                             measured_data_csv)
+        # An interrupted run is resumed from the frame journal next to the "measured_data_csv"
+        # The widths are converted to meters with the ratio calibrated for the track by an earlier session
+        pixel_ratio = calibration.load_pixel_ratio(pixel_ratios_json, track)
+        session_complete = batch_process_folder(latest_folder, timestamp_processed_images_folder, TEMPLATE_FOLDER,
+                                                measured_data_csv, pixel_ratio=pixel_ratio)
         print("Finished processing the gathered images\n")
 
-        processed_timestamps.add(timestamp)
-        save_processed_timestamps(processed_timestamps_log, processed_timestamps)
+        if session_complete:
+            processed_timestamps.add(timestamp)
+            save_processed_timestamps(processed_timestamps_log, processed_timestamps)
     else:
         print(f"\nSkipping image processing function (batch_process_folder) for {timestamp} (already processed)\n")
 
-    measured_df = pd.read_csv(measured_data_csv)
+    # The car center "(x, y)" is split into car_center_x and car_center_y
+    measured_df = session_table.split_car_center(pd.read_csv(measured_data_csv))
 
     # Checks if there are collected data points that do not have images and the other way around
     missing_images, missing_data_points = keepImagesWithCsvData.compare_images_with_csv(game_collected_data_csv,
@@ -70,8 +89,13 @@ if __name__ == '__main__':
     print(f"Missing images (only in CSV file): {0 if len(missing_images) == 0 else missing_images}")
     print(f"Extra images (not in CSV file): {0 if len(missing_data_points) == 0 else missing_data_points}\n")
 
-    # Merge together the game gathered data and the measured datasets
-    game_collected_measured_data_combined_df = mergeDFs.merge_dfs(game_df, measured_df)
+    # Merge together the game gathered data and the measured datasets. With a telemetry log the car position
+    # is interpolated to the moment each frame was grabbed, otherwise the game csv is joined by filename
+    if os.path.exists(telemetry_csv):
+        telemetry_df = pd.read_csv(telemetry_csv)
+        game_collected_measured_data_combined_df = mergeDFs.merge_telemetry(telemetry_df, measured_df)
+    else:
+        game_collected_measured_data_combined_df = mergeDFs.merge_dfs(game_df, measured_df)
     print("Merged the game collected and measured data\n")
 
     # Mapping the measured and the truth data and combining them into one csv file
@@ -83,27 +107,31 @@ if __name__ == '__main__':
 
     # Merge together previously merged dataset and the dataset with our measured racetrack information
     final_df_before_data_analysing = mergeDFs.merge_dfs(truth_measured_combined_df, measured_df)
+
+    # Straight, left or right from the curvature of the truth raceline, labelled once per track
+    segments = track_segments.load_track_segments(truth_df, truth_csv, track_segments_cache_folder)
+    final_df_before_data_analysing["road_type"] = segments.road_types(
+        final_df_before_data_analysing["closest_track_index"])
     print("Final merge successfully completed. The data will now be analyzed and results will be printed out.\n")
 
-    final_df_before_data_analysing.to_csv(merged_datasets_csv, index=False)
-
-    # Begin the results calculation process
-    analyse_results.evaluate_predictions(merged_datasets_csv, results_csv)
-
-    user_ready = input(
-        "\nHave you completed the road type grouping described in the README and as demonstrated at "
-        "the top of the analyze_results.py file, needed for road-type evaluation? (y/n): ").strip().lower()
-    if user_ready == "y":
-        # For debugging purposes the try-except block can be commented
-        try:
-            analyse_results.evaluate_by_road_type(results_csv)
-            analyse_results.generate_grouped_results(results_csv, road_type_grouped_results_csv)
-            print("\nRoad-type evaluation and grouped results generated successfully.\n")
-        except:
-            print("\nAn error occurred when generating the grouped results. Check for any errors in your work.\n")
-    else:
-        print("\nSkipping road-type evaluation and grouped results until manual work is complete. "
-              "Once you have finished re-run the main.py code.\n")
+    # Begin the results calculation process, which adds the row-wise metrics to the merged DataFrame
+    # The widths are compared in the pixel ratio the session was measured with
+    results_df = final_df_before_data_analysing
+    applied_ratio = calibration.load_applied_ratio(measured_data_csv)
+    analyse_results.evaluate_predictions(results_df, applied_ratio=applied_ratio)
+    results_file = session_table.save_session_table(results_df, results_csv, csv_export=EXPORT_CSV,
+                                                    pickle_fallback=PICKLE_FALLBACK)
+
+    # Sweep the pixel to meter ratio against the truth widths and keep the best one for the next sessions
+    ratio_result, ratio_sweep = calibration.calibrate_pixel_ratio(results_df, applied_ratio)
+    calibration.print_calibration(ratio_result, ratio_sweep)
+    ratio_sweep.to_csv(calibration_sweep_csv, index=False)
+    calibration.save_pixel_ratio(pixel_ratios_json, track, ratio_result)
+
+    # Metrics per road type and the frame by frame results grouped by road type
+    analyse_results.evaluate_by_road_type(results_df)
+    analyse_results.generate_grouped_results(results_df, road_type_grouped_results_csv)
+    print("\nRoad-type evaluation and grouped results generated successfully.\n")
 
     print("All the code has successfully finished running. The results can be in more detail seen in "
-          "the results.csv file.\n")
+          f"the {os.path.basename(results_csv if EXPORT_CSV else results_file)} file.\n")
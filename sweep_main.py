@@ -0,0 +1,54 @@
+import os
+import pandas as pd
+from functions.imageProcessing.parameter_sweep import parameter_grid, sweep_folder, rank_configurations
+from functions.frameStore.frame_store import list_frame_names
+from functions.analyseResults import mergeDFs, groundTruthMeasuredDataRelation, calibration
+from config import DATA, CSV, IMAGES, TRUTH_DATA, TEMPLATE_FOLDER, CALIBRATION
+
+# Values tried for each detection parameter, parameters that are left out keep the value batch_process_folder uses
+SWEEP_GRID = {
+    "threshold": [150, 170, 190],
+    "green_hsv_range": [((35, 40, 40), (90, 255, 255)), ((30, 30, 30), (95, 255, 255))],
+    "hist_threshold": [1, 2, 4],
+    "min_lane_width": [350, 450, 550],
+}
+# Every FRAME_STEP-th frame of the session is measured
+FRAME_STEP = 5
+WORKERS = 4
+# Car search of batch_process_folder in main.py, the configurations are ranked on the car boxes it finds
+PYRAMID_LEVELS = 0
+PYRAMID_TOP_K = 8
+
+if __name__ == '__main__':
+    # Measures the latest session with every configuration of SWEEP_GRID and ranks them against the truth data.
+    # The car is located once per frame and shared by all configurations
+    latest_folder = sorted(os.listdir(os.path.join(DATA, IMAGES)))[-1]
+    timestamp = latest_folder.replace("images_", "")
+
+    timestamp_csv_folder = os.path.join(DATA, CSV, timestamp)
+    game_collected_data_csv = os.path.join(timestamp_csv_folder, timestamp + ".csv")
+    telemetry_csv = os.path.join(timestamp_csv_folder, timestamp + "_telemetry.csv")
+    track = "ks_nurburgring-layout_gp_a"
+    truth_csv = os.path.join(DATA, TRUTH_DATA, track + ".csv")
+    sweep_csv = os.path.join(timestamp_csv_folder, "parameter_sweep.csv")
+
+    input_folder_path = os.path.join(DATA, IMAGES, latest_folder)
+    configs = parameter_grid(SWEEP_GRID)
+    measurements = sweep_folder(input_folder_path, TEMPLATE_FOLDER, configs, frame_step=FRAME_STEP, workers=WORKERS,
+                                pyramid_levels=PYRAMID_LEVELS, pyramid_top_k=PYRAMID_TOP_K)
+
+    # The truth width of a frame does not depend on the configuration, so the frames are mapped once
+    frames_df = pd.DataFrame({"filename": list_frame_names(input_folder_path)[::FRAME_STEP]})
+    if os.path.exists(telemetry_csv):
+        frames_df = mergeDFs.merge_telemetry(pd.read_csv(telemetry_csv), frames_df)
+    else:
+        frames_df = mergeDFs.merge_dfs(pd.read_csv(game_collected_data_csv), frames_df)
+    truth_df = groundTruthMeasuredDataRelation.map_measured_to_truth(pd.read_csv(truth_csv), frames_df)
+
+    pixel_ratio = calibration.load_pixel_ratio(os.path.join(DATA, CALIBRATION, "pixel_ratios.json"), track)
+    ranking = rank_configurations(measurements, truth_df, configs, pixel_ratio)
+    ranking.to_csv(sweep_csv, index=False)
+
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(ranking.head(20).to_string(index=False))
+    print(f"\nThe ranking of all {len(configs)} configurations was saved to {sweep_csv}")